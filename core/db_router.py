@@ -0,0 +1,159 @@
+"""
+Read-replica routing for read-only workloads.
+
+Writes, and every read outside an explicit replica block, go to the `default`
+(primary) database. Views that only read, such as the submission history and review
+pages, opt in with the `read_from_replica` decorator; their queries on quiz models are
+then served by the `replica` database, as long as it is reachable and not lagging
+behind the primary by more than DATABASE_REPLICA_MAX_LAG seconds.
+
+Right after a user writes (e.g. submits a quiz), `pin_to_primary` marks their session
+so the following DATABASE_REPLICA_PIN_SECONDS of their reads stay on the primary and
+they always see their own submission.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_ALIAS = 'default'
+REPLICA_ALIAS = 'replica'
+
+# Only these apps are ever read from the replica. Sessions and auth stay on the
+# primary so logins and session writes are never read back stale.
+REPLICA_APP_LABELS = {'quiz'}
+
+SESSION_PIN_KEY = '_db_primary_pinned_until'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+# alias -> (checked_at, healthy)
+_health_cache = {}
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def replica_lag_seconds(alias=REPLICA_ALIAS):
+    """
+    Returns how many seconds the replica is behind the primary. Backends without
+    streaming replication (such as the local SQLite stand-in) report 0.
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT CASE WHEN pg_is_in_recovery() "
+                "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+                "ELSE 0 END"
+            )
+            return float(cursor.fetchone()[0])
+        cursor.execute("SELECT 1")
+        return 0.0
+
+
+def replica_is_healthy(alias=REPLICA_ALIAS):
+    """
+    Returns True if the replica answers and its lag is within DATABASE_REPLICA_MAX_LAG.
+    The result is cached per process for DATABASE_REPLICA_CHECK_INTERVAL seconds.
+    """
+    now = time.monotonic()
+    cached = _health_cache.get(alias)
+    if cached and now - cached[0] < settings.DATABASE_REPLICA_CHECK_INTERVAL:
+        return cached[1]
+
+    try:
+        lag = replica_lag_seconds(alias)
+        healthy = lag <= settings.DATABASE_REPLICA_MAX_LAG
+        if not healthy:
+            logger.warning("Replica %r is %.1fs behind the primary; reading from the primary.", alias, lag)
+    except DatabaseError:
+        logger.exception("Replica %r is unreachable; reading from the primary.", alias)
+        healthy = False
+    _health_cache[alias] = (now, healthy)
+    return healthy
+
+
+@contextmanager
+def use_replica():
+    """
+    Routes reads on quiz models made inside the block to the replica.
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def pin_to_primary(request):
+    """
+    Keeps the user's reads on the primary for the next DATABASE_REPLICA_PIN_SECONDS,
+    so pages shown right after a write reflect it.
+    """
+    request.session[SESSION_PIN_KEY] = time.time() + settings.DATABASE_REPLICA_PIN_SECONDS
+
+
+def is_pinned_to_primary(request):
+    return request.session.get(SESSION_PIN_KEY, 0) > time.time()
+
+
+def read_from_replica(view_func):
+    """
+    View decorator serving a read-only view's queries from the replica.
+
+    Only GET and HEAD requests are routed, and never for a session pinned to the
+    primary. Template responses are rendered inside the replica block so their lazy
+    querysets are evaluated there too. Place it below @login_required so the
+    session and user are loaded from the primary first.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if (
+            not replica_configured()
+            or request.method not in ('GET', 'HEAD')
+            or is_pinned_to_primary(request)
+        ):
+            return view_func(request, *args, **kwargs)
+        with use_replica():
+            response = view_func(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        return response
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Sends reads made inside a `use_replica` block to the replica when it is healthy,
+    and everything else to the primary. Reads inside a transaction on the primary
+    stay there, since the replica cannot see uncommitted rows (this also keeps
+    TestCase-based tests, which run in a transaction, on the primary).
+    Only the primary is migrated.
+    """
+    def db_for_read(self, model, **hints):
+        if (
+            _replica_reads.get()
+            and model._meta.app_label in REPLICA_APP_LABELS
+            and not connections[PRIMARY_ALIAS].in_atomic_block
+            and replica_is_healthy()
+        ):
+            return REPLICA_ALIAS
+        return PRIMARY_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY_ALIAS
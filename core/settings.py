@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+from datetime import timedelta
 from pathlib import Path
 import dj_database_url
 from dotenv import load_dotenv
@@ -61,6 +62,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Opt-in request profiling; needs request.user from AuthenticationMiddleware
+    'quiz.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -99,14 +102,37 @@ if 'DATABASE_URL' in os.environ:
             ssl_require=False # Set to True if your DB requires SSL
         )
     }
+    # Read replica for read-only pages. Tests mirror it onto 'default'.
+    if 'REPLICA_DATABASE_URL' in os.environ:
+        DATABASES['replica'] = dj_database_url.parse(
+            os.environ['REPLICA_DATABASE_URL'],
+            conn_max_age=600,
+        )
+        DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
 else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
-        }
+        },
+        # Local stand-in for the read replica: a second connection to the same
+        # SQLite file, so the replica routing code paths also run in development.
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'TEST': {'MIRROR': 'default'},
+        },
     }
 
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+
+# Reads fall back to the primary when the replica is further behind than this (seconds).
+DATABASE_REPLICA_MAX_LAG = float(os.environ.get('DATABASE_REPLICA_MAX_LAG', '10'))
+# How often each process re-checks replica health and lag (seconds).
+DATABASE_REPLICA_CHECK_INTERVAL = float(os.environ.get('DATABASE_REPLICA_CHECK_INTERVAL', '5'))
+# After a user writes, their reads stay on the primary for this long (seconds).
+DATABASE_REPLICA_PIN_SECONDS = float(os.environ.get('DATABASE_REPLICA_PIN_SECONDS', '15'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -167,6 +193,41 @@ LOGIN_REDIRECT_URL = 'quiz:quiz_list'
 LOGIN_URL = 'login'
 
 
+# --- Quiz Settings ---
+# Late submissions are still accepted for this long after a submission's deadline,
+# so the auto-submit fired by the browser timer is not rejected because of latency.
+QUIZ_DEADLINE_GRACE_PERIOD = timedelta(seconds=int(os.environ.get('QUIZ_DEADLINE_GRACE_SECONDS', '30')))
+# Store new MCQ/MSQ answers as one packed record on the submission instead of
+# one UserAnswer row (plus selected-choice rows) per question.
+QUIZ_PACKED_CHOICE_ANSWERS = os.environ.get('QUIZ_PACKED_CHOICE_ANSWERS', 'False').lower() == 'true'
+# Each worker process persists at most this many quiz submissions concurrently.
+# The slots are shared by the threads of a process, so this only limits anything when
+# a worker serves several requests at once: run gunicorn with the gthread worker class
+# and more threads than this (e.g. --worker-class gthread --threads 16). Sync workers
+# serve one request at a time and are never throttled.
+QUIZ_SUBMISSION_CONCURRENCY = int(os.environ.get('QUIZ_SUBMISSION_CONCURRENCY', '8'))
+# Seconds a submission waits for a free slot before it is spooled instead.
+QUIZ_SUBMISSION_ADMISSION_TIMEOUT = float(os.environ.get('QUIZ_SUBMISSION_ADMISSION_TIMEOUT', '0.5'))
+# Local directory where over-capacity submissions are spooled until persisted.
+QUIZ_SUBMISSION_SPOOL_DIR = os.environ.get('QUIZ_SUBMISSION_SPOOL_DIR', BASE_DIR / 'spool' / 'submissions')
+# Seconds a processed submit token is remembered in the cache, so replays of the
+# same quiz form are redirected to the existing submission without database writes.
+QUIZ_SUBMIT_TOKEN_CACHE_TIMEOUT = int(os.environ.get('QUIZ_SUBMIT_TOKEN_CACHE_TIMEOUT', '600'))
+# Profile 1 in N requests automatically (0 disables sampling). Staff can always
+# profile a single request with the X-Profile header or the _profile query parameter.
+QUIZ_PROFILE_SAMPLE_RATE = int(os.environ.get('QUIZ_PROFILE_SAMPLE_RATE', '0'))
+# Seconds between stack samples of a profiled request.
+QUIZ_PROFILE_INTERVAL = float(os.environ.get('QUIZ_PROFILE_INTERVAL', '0.005'))
+# Directory where request profiles are written. Profiles contain SQL and request
+# paths, so keep this out of MEDIA_ROOT and other publicly served directories.
+QUIZ_PROFILE_DIR = os.environ.get('QUIZ_PROFILE_DIR', BASE_DIR / 'profiles')
+# Only the most recent profiles of each view are kept; older ones are deleted.
+QUIZ_PROFILE_MAX_PER_VIEW = int(os.environ.get('QUIZ_PROFILE_MAX_PER_VIEW', '100'))
+# Estimated Jaccard similarity of normalized token shingles from which two coding
+# answers to the same question are reported as near-duplicates.
+QUIZ_SIMILARITY_THRESHOLD = float(os.environ.get('QUIZ_SIMILARITY_THRESHOLD', '0.8'))
+
+
 # --- Production Security Settings ---
 # These settings will be active if DEBUG is False.
 if not DEBUG:
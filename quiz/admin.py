@@ -1,18 +1,274 @@
+import uuid
 from django.contrib import admin, messages
-from .models import Quiz, Question, Choice, QuizSubmission, UserAnswer
-from django.utils.html import format_html
+from django.db import transaction
+from django.db.models import Prefetch
+from django.db.models.functions import Length, Substr
+from django.http import HttpResponse, HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from core.db_router import pin_to_primary, read_from_replica
+from .forms import CodeAnswerGradeForm
+from .models import Quiz, Question, Choice, QuizSubmission, UserAnswer, ArchivedSubmission, CodeSignature, regrade_questions, unpack_choice_answers
+from .similarity import cluster_sizes, similar_clusters, unindexed_answers
+from django.utils.html import format_html, format_html_join
+
+# Number of characters of a code submission rendered inline on the change page.
+# Longer submissions are loaded on demand through the full-code admin view.
+CODE_PREVIEW_LENGTH = 2000
+
+# Number of answers shown per page of the grade-by-question workspace.
+GRADING_PAGE_SIZE = 25
+
+
+def _parse_uuid(value):
+    try:
+        return uuid.UUID(value) if value else None
+    except ValueError:
+        return None
+
+
+class PrimaryPinningAdmin(admin.ModelAdmin):
+    """
+    Pins the session to the primary on every POST to the add, change, delete and
+    changelist (actions) views, so the page an admin is redirected to after a save
+    reflects it instead of a lagging replica.
+    """
+    def changeform_view(self, request, *args, **kwargs):
+        if request.method == 'POST':
+            pin_to_primary(request)
+        return super().changeform_view(request, *args, **kwargs)
+
+    def delete_view(self, request, *args, **kwargs):
+        if request.method == 'POST':
+            pin_to_primary(request)
+        return super().delete_view(request, *args, **kwargs)
+
+    def changelist_view(self, request, *args, **kwargs):
+        if request.method == 'POST':
+            pin_to_primary(request)
+        return super().changelist_view(request, *args, **kwargs)
+
+
+class QuizListFilter(admin.RelatedFieldListFilter):
+    """
+    Sidebar filter for a `quiz` foreign key that only fetches the id and title
+    of each quiz, instead of instantiating every Quiz row.
+    """
+    def field_choices(self, field, request, model_admin):
+        return list(Quiz.objects.order_by('title').values_list('pk', 'title'))
+
 
 class ChoiceInline(admin.TabularInline):
     model = Choice
     extra = 1
 
-class QuestionAdmin(admin.ModelAdmin):
+class QuestionAdmin(PrimaryPinningAdmin):
     inlines = [ChoiceInline]
-    list_display = ('question_text', 'quiz', 'question_type', 'points', 'order')
-    list_filter = ('quiz', 'question_type')
+    list_display = ('question_text', 'quiz', 'question_type', 'points', 'order', 'grade_answers_link')
+    list_filter = (('quiz', QuizListFilter), 'question_type')
+    list_select_related = ('quiz',)
+    actions = ['regrade_answers']
+
+    def regrade_answers(self, request, queryset):
+        """
+        Custom admin action to re-score the existing answers to the selected MCQ/MSQ
+        questions after their correct choices were changed.
+        """
+        changed_count, rescored_count = regrade_questions(queryset)
+        self.message_user(
+            request,
+            f"{changed_count} answer(s) changed; {rescored_count} submission(s) rescored.",
+            messages.SUCCESS,
+        )
+    regrade_answers.short_description = "Regrade existing answers to selected questions"
 
-class QuizAdmin(admin.ModelAdmin):
+    def grade_answers_link(self, obj):
+        if obj.question_type != Question.QuestionType.CODING:
+            return "-"
+        return format_html(
+            '<a href="{}">Grade answers</a> | <a href="{}">Similar answers</a>',
+            reverse('admin:quiz_question_grade', args=[obj.pk]),
+            reverse('admin:quiz_question_similarity', args=[obj.pk]),
+        )
+    grade_answers_link.short_description = "Grading"
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<uuid:question_id>/grade/',
+                self.admin_site.admin_view(self.grade_answers_view),
+                name='quiz_question_grade',
+            ),
+            path(
+                '<uuid:question_id>/similarity/',
+                self.admin_site.admin_view(self.similarity_view),
+                name='quiz_question_similarity',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def grade_answers_view(self, request, question_id):
+        """
+        Grade-by-question workspace: lists every answer to one coding question
+        across all submissions, one keyset-paginated page at a time.
+
+        Query parameters:
+            after / before: keyset cursors (answer ids) for the next / previous page.
+            ungraded: when set, only answers without points are listed.
+
+        Saving writes all changed answers on the page with a single bulk update.
+        Finalizing additionally completes every affected submission whose coding
+        answers have all been graded. Each listed answer shows the size of its
+        cluster of near-duplicates, as indexed by `manage.py index_code_similarity`.
+        """
+        if not self.has_change_permission(request):
+            return HttpResponse(status=403)
+        question = get_object_or_404(
+            Question.objects.select_related('quiz'),
+            pk=question_id,
+            question_type=Question.QuestionType.CODING,
+        )
+        answers = UserAnswer.objects.filter(question=question).select_related('submission__user')
+        ungraded_only = bool(request.GET.get('ungraded'))
+        # The keyset queries only read answer ids; the page rows are loaded afterwards.
+        page_ids = answers.values_list('pk', flat=True)
+        if ungraded_only:
+            page_ids = page_ids.filter(points_awarded__isnull=True)
+        has_previous = has_next = False
+
+        if request.method == 'POST':
+            # The page redirected to after saving must show the new grades.
+            pin_to_primary(request)
+            # Only the answers posted from the page are loaded, in a single query.
+            answer_ids = [pk for pk in map(_parse_uuid, request.POST.getlist('answer_ids')) if pk]
+            page_answers = list(answers.filter(pk__in=answer_ids).order_by('pk'))
+            forms = [
+                CodeAnswerGradeForm(request.POST, instance=answer, prefix=str(answer.pk), max_points=question.points)
+                for answer in page_answers
+            ]
+            if all([form.is_valid() for form in forms]):
+                changed_answers = [form.instance for form in forms if form.has_changed()]
+                finalized_count = None
+                with transaction.atomic():
+                    UserAnswer.objects.bulk_update(changed_answers, ['points_awarded', 'feedback'])
+                    # bulk_update() bypasses scoring, and finalizing only scores SUBMITTED
+                    # submissions: rescore completed ones whose answers were regraded.
+                    QuizSubmission.objects.filter(
+                        pk__in={answer.submission_id for answer in changed_answers},
+                        status=QuizSubmission.SubmissionStatus.COMPLETED,
+                    ).recalculate_scores()
+                    if '_finalize' in request.POST:
+                        affected = QuizSubmission.objects.filter(
+                            pk__in=UserAnswer.objects.filter(question=question).values('submission')
+                        )
+                        finalized_count = affected.fully_graded().finalize_grades()
+
+                self.message_user(request, f"{len(changed_answers)} answer(s) saved.", messages.SUCCESS)
+                if finalized_count is not None:
+                    self.message_user(request, f"{finalized_count} submission(s) have been graded and finalized.", messages.SUCCESS)
+                return HttpResponseRedirect(request.get_full_path())
+            # The posted page is shown again with its errors, and the same navigation.
+            if page_answers:
+                has_previous = page_ids.filter(pk__lt=page_answers[0].pk).exists()
+                has_next = page_ids.filter(pk__gt=page_answers[-1].pk).exists()
+        else:
+            after = _parse_uuid(request.GET.get('after'))
+            before = _parse_uuid(request.GET.get('before'))
+            if before:
+                page_ids = list(page_ids.filter(pk__lt=before).order_by('-pk')[:GRADING_PAGE_SIZE + 1])
+                has_previous = len(page_ids) > GRADING_PAGE_SIZE
+                has_next = True
+            else:
+                if after:
+                    page_ids = page_ids.filter(pk__gt=after)
+                page_ids = list(page_ids.order_by('pk')[:GRADING_PAGE_SIZE + 1])
+                has_next = len(page_ids) > GRADING_PAGE_SIZE
+                has_previous = after is not None
+            page_answers = list(answers.filter(pk__in=page_ids[:GRADING_PAGE_SIZE]).order_by('pk'))
+            forms = [
+                CodeAnswerGradeForm(instance=answer, prefix=str(answer.pk), max_points=question.points)
+                for answer in page_answers
+            ]
+        self.attach_clusters(question, page_answers)
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f"Grade answers: {question}",
+            'question': question,
+            'forms': forms,
+            'ungraded_only': ungraded_only,
+            'next_cursor': page_answers[-1].pk if has_next and page_answers else None,
+            'previous_cursor': page_answers[0].pk if has_previous and page_answers else None,
+            'unindexed_count': unindexed_answers().filter(question=question).count(),
+        }
+        return TemplateResponse(request, 'admin/quiz/question/grade_answers.html', context)
+
+    def attach_clusters(self, question, answers):
+        """
+        Sets `cluster_id`, `cluster_size` and `cluster_similarity` on each of `answers`
+        that has near-duplicates; `cluster_size` is None on the others.
+        """
+        clusters = {
+            answer_id: (cluster_id, similarity)
+            for answer_id, cluster_id, similarity in CodeSignature.objects.filter(
+                answer__in=answers, cluster_id__isnull=False,
+            ).values_list('answer_id', 'cluster_id', 'similarity')
+        }
+        sizes = cluster_sizes(question, {cluster_id for cluster_id, _ in clusters.values()})
+        for answer in answers:
+            answer.cluster_id, answer.cluster_similarity = clusters.get(answer.pk, (None, None))
+            answer.cluster_size = sizes.get(answer.cluster_id)
+
+    def similarity_view(self, request, question_id):
+        """
+        Lists the clusters of near-duplicate answers to one coding question. Answers
+        are indexed by `manage.py index_code_similarity`, not by this view; the
+        number still waiting to be indexed is shown.
+        """
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        question = get_object_or_404(
+            Question.objects.select_related('quiz'),
+            pk=question_id,
+            question_type=Question.QuestionType.CODING,
+        )
+        clusters = similar_clusters(question)
+        members = UserAnswer.objects.filter(
+            pk__in={answer_id for _, answer_ids, _ in clusters for answer_id in answer_ids}
+        ).select_related('submission__user').only('id', 'submission__id', 'submission__user__username')
+        members = {answer.pk: answer for answer in members}
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f"Similar answers: {question}",
+            'question': question,
+            'unindexed_count': unindexed_answers().filter(question=question).count(),
+            'clusters': [
+                (cluster_id, sorted((members[answer_id] for answer_id in answer_ids if answer_id in members), key=lambda answer: answer.submission.user.username), similarity)
+                for cluster_id, answer_ids, similarity in clusters
+            ],
+        }
+        return TemplateResponse(request, 'admin/quiz/question/similarity.html', context)
+
+class QuizAdmin(PrimaryPinningAdmin):
     list_display = ('title', 'duration', 'created_at')
+    actions = ['regrade_choice_answers']
+
+    def regrade_choice_answers(self, request, queryset):
+        """
+        Custom admin action to re-score the existing MCQ/MSQ answers of the selected
+        quizzes, e.g. after a wrong `is_correct` flag was fixed.
+        """
+        questions = Question.objects.filter(quiz__in=queryset).exclude(question_type=Question.QuestionType.CODING)
+        changed_count, rescored_count = regrade_questions(questions)
+        self.message_user(
+            request,
+            f"{changed_count} answer(s) changed; {rescored_count} submission(s) rescored.",
+            messages.SUCCESS,
+        )
+    regrade_choice_answers.short_description = "Regrade MCQ/MSQ answers of selected quizzes"
 
 class UserAnswerInline(admin.TabularInline):
     model = UserAnswer
@@ -21,13 +277,43 @@ class UserAnswerInline(admin.TabularInline):
     readonly_fields = ('question', 'selected_choices_display', 'code_answer_display')
     fields = ('question', 'selected_choices_display', 'code_answer_display', 'points_awarded', 'feedback')
 
+    def get_queryset(self, request):
+        """
+        Loads every answer of the submission with its question and selected choices
+        in a fixed number of queries. The full `code_answer` body is deferred; only a
+        bounded preview and the total length are read from the database.
+        """
+        return (
+            super().get_queryset(request)
+            .select_related('question')
+            .prefetch_related(Prefetch('selected_choices', queryset=Choice.objects.only('id', 'choice_text')))
+            .defer('code_answer')
+            .annotate(
+                code_answer_preview=Substr('code_answer', 1, CODE_PREVIEW_LENGTH),
+                code_answer_length=Length('code_answer'),
+            )
+            .order_by('question__order')
+        )
+
     def selected_choices_display(self, obj):
         return ", ".join([choice.choice_text for choice in obj.selected_choices.all()])
     selected_choices_display.short_description = "Selected Choices"
 
     def code_answer_display(self, obj):
         # Display code in a preformatted block for readability
-        return format_html("<pre><code>{}</code></pre>", obj.code_answer) if obj.code_answer else "N/A"
+        if not obj.code_answer_length:
+            return "N/A"
+        if obj.code_answer_length <= CODE_PREVIEW_LENGTH:
+            return format_html("<pre><code>{}</code></pre>", obj.code_answer_preview)
+        # Large submissions are truncated here; the full body is fetched on demand.
+        full_code_url = reverse(
+            'admin:quiz_quizsubmission_answer_code',
+            args=[obj.submission_id, obj.pk],
+        )
+        return format_html(
+            '<pre><code>{}</code></pre><a href="{}" target="_blank">View full submission ({} characters)</a>',
+            obj.code_answer_preview, full_code_url, obj.code_answer_length,
+        )
     code_answer_display.short_description = "Code Submission"
     
     def has_change_permission(self, request, obj=None):
@@ -42,29 +328,77 @@ class UserAnswerInline(admin.TabularInline):
         # Don't want admins accidentally deleting answer history
         return False
 
-class QuizSubmissionAdmin(admin.ModelAdmin):
+class QuizSubmissionAdmin(PrimaryPinningAdmin):
     inlines = [UserAnswerInline]
     list_display = ('user', 'quiz', 'status', 'score', 'end_time')
-    list_filter = ('status', 'quiz')
+    list_filter = ('status', ('quiz', QuizListFilter))
+    list_select_related = ('user', 'quiz')
+    # Skip the unfiltered COUNT(*) over the whole submissions table on every changelist load.
+    show_full_result_count = False
     # We make score readonly here because it should only be set via the 'finalize_grades' action
-    readonly_fields = ('user', 'quiz', 'start_time', 'end_time', 'score')
+    readonly_fields = ('user', 'quiz', 'start_time', 'end_time', 'score', 'choice_answers_display')
+    exclude = ('choice_answers', 'choice_points')
     actions = ['finalize_grades']
 
+    def choice_answers_display(self, obj):
+        # Packed MCQ/MSQ answers have no UserAnswer rows, so they are listed here instead of the inline.
+        if obj.choice_answers is None:
+            return "N/A"
+        questions = obj.quiz.questions.prefetch_related('choices')
+        choice_ids = {q.id: [c.id for c in q.choices.all()] for q in questions}
+        selected = unpack_choice_answers(obj.choice_answers, choice_ids)
+        rows = format_html_join(
+            '', '<li>{}: {}</li>',
+            (
+                (q.question_text[:50], ", ".join(c.choice_text for c in q.choices.all() if c.id in selected[q.id]))
+                for q in questions if q.id in selected
+            ),
+        )
+        return format_html("<ul>{}</ul><p>Points: {}</p>", rows, obj.choice_points)
+    choice_answers_display.short_description = "Choice Answers"
+
+    def get_queryset(self, request):
+        # The change page renders `user` and `quiz` as read-only fields.
+        return super().get_queryset(request).select_related('user', 'quiz')
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method == 'POST':
+            # Actions such as finalize_grades write to the primary, which pins the session.
+            return super().changelist_view(request, extra_context)
+        # The submissions list is read-only reporting; serve it from the replica.
+        return read_from_replica(super().changelist_view)(request, extra_context)
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<uuid:submission_id>/answers/<uuid:answer_id>/code/',
+                self.admin_site.admin_view(self.answer_code_view),
+                name='quiz_quizsubmission_answer_code',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def answer_code_view(self, request, submission_id, answer_id):
+        """
+        Returns the full `code_answer` body of a single answer as plain text.
+        """
+        if not self.has_view_or_change_permission(request):
+            return HttpResponse(status=403)
+        code_answer = get_object_or_404(
+            UserAnswer.objects.values_list('code_answer', flat=True),
+            pk=answer_id,
+            submission_id=submission_id,
+        )
+        return HttpResponse(code_answer, content_type='text/plain; charset=utf-8')
+
     def finalize_grades(self, request, queryset):
         """
         Custom admin action to calculate the final score, update the status,
         and save the submission.
         """
-        updated_count = 0
-        for submission in queryset:
-            if submission.status == QuizSubmission.SubmissionStatus.SUBMITTED:
-                # The model method now simply calculates and returns the score
-                final_score = submission.calculate_final_score()
-                submission.score = final_score
-                submission.status = QuizSubmission.SubmissionStatus.COMPLETED
-                submission.save() # Single save call for all changes
-                updated_count += 1
-        
+        # Scores are summed and written for all selected submissions in one UPDATE.
+        updated_count = queryset.finalize_grades()
+
         if updated_count > 0:
             self.message_user(request, f"{updated_count} submission(s) have been graded and finalized.", messages.SUCCESS)
         else:
@@ -72,8 +406,26 @@ class QuizSubmissionAdmin(admin.ModelAdmin):
 
     finalize_grades.short_description = "Finalize grades for selected submissions"
 
+class ArchivedSubmissionAdmin(PrimaryPinningAdmin):
+    list_display = ('user', 'quiz', 'status', 'score', 'start_time', 'archived_at')
+    list_filter = ('status', ('quiz', QuizListFilter))
+    list_select_related = ('user', 'quiz')
+    show_full_result_count = False
+    # Archived submissions are immutable; the answers payload is not shown.
+    exclude = ('answers_payload',)
+    readonly_fields = ('user', 'quiz', 'start_time', 'end_time', 'score', 'status', 'archived_at')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user', 'quiz').defer('answers_payload')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # Register your models here
 admin.site.register(Quiz, QuizAdmin)
 admin.site.register(Question, QuestionAdmin)
 admin.site.register(QuizSubmission, QuizSubmissionAdmin)
-
+admin.site.register(ArchivedSubmission, ArchivedSubmissionAdmin)
@@ -0,0 +1,265 @@
+"""
+Admission control for quiz submissions.
+
+Each worker process admits at most QUIZ_SUBMISSION_CONCURRENCY submissions to the
+database at once. A submission that cannot get a slot within
+QUIZ_SUBMISSION_ADMISSION_TIMEOUT seconds is not rejected: it is written to a durable
+spool directory on local disk (QUIZ_SUBMISSION_SPOOL_DIR) and persisted later by a
+background drainer thread, which takes the same slots. This flattens the burst when a
+whole cohort's timers expire in the same second.
+
+The limit is per process and shared by its threads, so it requires threaded workers
+(gunicorn's gthread worker class with more threads than QUIZ_SUBMISSION_CONCURRENCY);
+a sync worker handles one request at a time and never waits for a slot.
+
+Spool entries are claimed by renaming them, so several worker processes can share one
+spool directory. Entries left claimed by a crashed worker are put back by
+`manage.py drain_submission_spool --reclaim-after <seconds>`.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.datastructures import MultiValueDict
+
+logger = logging.getLogger(__name__)
+
+CLAIMED_SUFFIX = '.claimed'
+# Form fields that are not answers and are not worth spooling.
+IGNORED_FIELDS = {'csrfmiddlewaretoken'}
+
+_slots = None
+_slots_lock = threading.Lock()
+_drainer_lock = threading.Lock()
+_drainer_running = False
+
+# Per-process counters, exposed by the submission metrics view.
+_counters_lock = threading.Lock()
+counters = {
+    'in_flight': 0,
+    'admitted_total': 0,
+    'spooled_total': 0,
+    'drained_total': 0,
+    'failed_total': 0,
+}
+
+
+def _increment(name, amount=1):
+    with _counters_lock:
+        counters[name] += amount
+
+
+def _get_slots():
+    global _slots
+    with _slots_lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(settings.QUIZ_SUBMISSION_CONCURRENCY)
+        return _slots
+
+
+def acquire_slot(timeout=None):
+    """
+    Waits up to `timeout` seconds (forever when None) for a submission slot.
+    Returns True if one was acquired; it must then be released with release_slot().
+    """
+    acquired = _get_slots().acquire(timeout=timeout)
+    if acquired:
+        _increment('in_flight')
+    return acquired
+
+
+def try_admit():
+    """
+    Tries to admit a posted submission for immediate processing, waiting up to
+    QUIZ_SUBMISSION_ADMISSION_TIMEOUT seconds for a slot. Returns True when admitted.
+    """
+    if acquire_slot(timeout=settings.QUIZ_SUBMISSION_ADMISSION_TIMEOUT):
+        _increment('admitted_total')
+        return True
+    return False
+
+
+def release_slot():
+    _increment('in_flight', -1)
+    _get_slots().release()
+
+
+def spool_dir():
+    path = Path(settings.QUIZ_SUBMISSION_SPOOL_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _entry_prefix(user_id, quiz_id):
+    return f"{user_id}-{quiz_id.hex}"
+
+
+def spool_submission(user_id, quiz_id, data, received_at, handler):
+    """
+    Durably writes a posted quiz form to the spool and makes sure a drainer thread
+    will persist it (see process_claimed for the `handler` signature).
+    """
+    entry = {
+        'user_id': user_id,
+        'quiz_id': quiz_id.hex,
+        'received_at': received_at.isoformat(),
+        'data': {key: data.getlist(key) for key in data if key not in IGNORED_FIELDS},
+    }
+    directory = spool_dir()
+    # Entry names sort by arrival, so entries are drained oldest first.
+    name = f"{received_at:%Y%m%dT%H%M%S%f}-{_entry_prefix(user_id, quiz_id)}-{uuid.uuid4().hex[:8]}.json"
+    temporary_path = directory / f".{name}.tmp"
+    with open(temporary_path, 'w') as f:
+        json.dump(entry, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, directory / name)
+    _increment('spooled_total')
+    _ensure_drainer(handler)
+
+
+def load_entry(path):
+    """
+    Reads a spool entry, returning the user id, quiz id, form data and receive time.
+    """
+    with open(path) as f:
+        entry = json.load(f)
+    return (
+        entry['user_id'],
+        uuid.UUID(entry['quiz_id']),
+        MultiValueDict(entry['data']),
+        parse_datetime(entry['received_at']),
+    )
+
+
+def spool_depth():
+    """
+    Number of spooled submissions not yet persisted (claimed ones included).
+    """
+    # A single directory listing, so an entry being claimed is not counted twice.
+    return sum(
+        1 for name in os.listdir(spool_dir())
+        if name.endswith('.json') or name.endswith(f'.json{CLAIMED_SUFFIX}')
+    )
+
+
+def has_pending(user_id, quiz_id):
+    """
+    Returns True if this host's spool holds a submission of the user for the quiz.
+    Entries spooled on other hosts are not seen.
+    """
+    directory = spool_dir()
+    prefix = _entry_prefix(user_id, quiz_id)
+    return any(directory.glob(f'*-{prefix}-*.json*'))
+
+
+def claim_next():
+    """
+    Claims the oldest unclaimed spool entry by renaming it, and returns the claimed
+    path, or None when the spool is empty.
+    """
+    for path in sorted(spool_dir().glob('*.json')):
+        claimed = path.with_name(path.name + CLAIMED_SUFFIX)
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            # Claimed by another worker in the meantime.
+            continue
+        return claimed
+    return None
+
+
+def reclaim_stale(older_than):
+    """
+    Puts back entries claimed more than `older_than` seconds ago, e.g. by a worker
+    that crashed while persisting them. Returns how many were put back.
+    """
+    reclaimed = 0
+    cutoff = time.time() - older_than
+    for path in spool_dir().glob(f'*.json{CLAIMED_SUFFIX}'):
+        if path.stat().st_mtime < cutoff:
+            os.rename(path, path.with_name(path.name[:-len(CLAIMED_SUFFIX)]))
+            reclaimed += 1
+    return reclaimed
+
+
+def process_claimed(path, handler):
+    """
+    Persists one claimed entry with `handler(user_id, quiz_id, data, received_at)`
+    inside a submission slot. Entries that fail are moved to the `failed` directory.
+    """
+    acquire_slot()
+    try:
+        handler(*load_entry(path))
+    except Exception:
+        logger.exception("Could not persist spooled submission %s.", path.name)
+        failed_dir = spool_dir() / 'failed'
+        failed_dir.mkdir(exist_ok=True)
+        os.replace(path, failed_dir / path.name)
+        _increment('failed_total')
+        return False
+    finally:
+        release_slot()
+    path.unlink()
+    _increment('drained_total')
+    return True
+
+
+def drain(handler):
+    """
+    Persists spooled entries until the spool is empty. Returns how many were processed.
+    """
+    processed = 0
+    while (path := claim_next()) is not None:
+        process_claimed(path, handler)
+        processed += 1
+    return processed
+
+
+def _drainer(handler):
+    global _drainer_running
+    try:
+        while True:
+            drain(handler)
+            with _drainer_lock:
+                # Re-check under the lock: spool_submission only starts a new drainer
+                # when it sees none running, so no entry can be left behind.
+                if not any(spool_dir().glob('*.json')):
+                    _drainer_running = False
+                    return
+    except Exception:
+        logger.exception("Submission spool drainer stopped.")
+        with _drainer_lock:
+            _drainer_running = False
+    finally:
+        connections.close_all()
+
+
+def _ensure_drainer(handler):
+    global _drainer_running
+    with _drainer_lock:
+        if _drainer_running:
+            return
+        _drainer_running = True
+    threading.Thread(target=_drainer, args=(handler,), name='submission-spool-drainer', daemon=True).start()
+
+
+def metrics():
+    with _counters_lock:
+        snapshot = dict(counters)
+    snapshot.update({
+        'pid': os.getpid(),
+        'capacity': settings.QUIZ_SUBMISSION_CONCURRENCY,
+        'spool_depth': spool_depth(),
+        'drainer_running': _drainer_running,
+        'time': timezone.now().isoformat(),
+    })
+    return snapshot
@@ -0,0 +1,240 @@
+"""
+Microbenchmarks of the quiz hot paths, run by `manage.py run_benchmarks`.
+
+Each benchmark is a context manager that builds its fixtures for a given quiz size
+(number of questions) and yields the callable to measure. `measure` runs it once to
+warm up caches, once to count queries, once under tracemalloc to record allocations,
+and `repeat` more times for timings.
+"""
+import gc
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+import uuid
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connections, reset_queries
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from .models import Choice, Question, Quiz, QuizSubmission, UserAnswer
+from .views import submission_detail_context
+
+CHOICES_PER_QUESTION = 4
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Registers a fixture context manager under `name`.
+    """
+    def register(setup):
+        BENCHMARKS[name] = contextmanager(setup)
+        return setup
+    return register
+
+
+def question_type_for(index):
+    # Two MCQs, two MSQs and one coding question in every five questions.
+    return (
+        Question.QuestionType.MCQ,
+        Question.QuestionType.MSQ,
+        Question.QuestionType.MCQ,
+        Question.QuestionType.MSQ,
+        Question.QuestionType.CODING,
+    )[index % 5]
+
+
+def quiz_data(size):
+    """
+    Returns a quiz of `size` questions in the `load_quizzes` JSON format.
+    """
+    questions = []
+    for index in range(size):
+        question_type = question_type_for(index)
+        questions.append({
+            'question_text': f"Question {index}",
+            'question_type': question_type,
+            'points': 2,
+            'order': index,
+            'choices': [] if question_type == Question.QuestionType.CODING else [
+                {'choice_text': f"Choice {number}", 'is_correct': number == 0 or (number == 1 and question_type == Question.QuestionType.MSQ)}
+                for number in range(CHOICES_PER_QUESTION)
+            ],
+        })
+    return {'title': f"Benchmark quiz ({size} questions)", 'time_limit_minutes': 60, 'questions': questions}
+
+
+def create_quiz(size):
+    data = quiz_data(size)
+    quiz = Quiz.objects.create(title=data['title'], duration=timedelta(minutes=data['time_limit_minutes']))
+    questions = Question.objects.bulk_create([
+        Question(quiz=quiz, question_text=question['question_text'], question_type=question['question_type'],
+                 points=question['points'], order=question['order'])
+        for question in data['questions']
+    ])
+    Choice.objects.bulk_create([
+        Choice(question=question, choice_text=choice['choice_text'], is_correct=choice['is_correct'])
+        for question, question_data in zip(questions, data['questions'])
+        for choice in question_data['choices']
+    ])
+    return quiz
+
+
+def create_submission(quiz):
+    """
+    Creates a user and an answered submission for `quiz`: every other choice
+    question is answered correctly, and every coding question gets some code.
+    """
+    user = User.objects.create_user(f"benchmark-{uuid.uuid4().hex[:12]}")
+    submission = QuizSubmission.objects.create(user=user, quiz=quiz)
+    questions = list(quiz.questions.order_by('order').prefetch_related('choices'))
+    answers = UserAnswer.objects.bulk_create([
+        UserAnswer(
+            submission=submission,
+            question=question,
+            code_answer="def solve(n):\n    return sum(range(n))\n" if question.question_type == Question.QuestionType.CODING else '',
+        )
+        for question in questions
+    ])
+    through_rows = []
+    for index, (question, answer) in enumerate(zip(questions, answers)):
+        choices = list(question.choices.all())
+        if not choices:
+            continue
+        selected = [choice for choice in choices if choice.is_correct] if index % 2 == 0 else choices[-1:]
+        through_rows.extend(UserAnswer.selected_choices.through(useranswer=answer, choice=choice) for choice in selected)
+    UserAnswer.selected_choices.through.objects.bulk_create(through_rows)
+    return submission
+
+
+@benchmark('grade_mcq_msq')
+def grade_mcq_msq_benchmark(size):
+    submission = create_submission(create_quiz(size))
+    yield submission.grade_mcq_msq
+
+
+@benchmark('calculate_final_score')
+def calculate_final_score_benchmark(size):
+    submission = create_submission(create_quiz(size))
+    submission.grade_mcq_msq()
+    yield submission.calculate_final_score
+
+
+@benchmark('load_quizzes')
+def load_quizzes_benchmark(size):
+    # Note that load_quizzes replaces every quiz in the (test) database.
+    descriptor, path = tempfile.mkstemp(suffix='.json')
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump({'quizzes': [quiz_data(size)]}, f)
+        yield lambda: call_command('load_quizzes', path, stdout=StringIO())
+    finally:
+        os.remove(path)
+
+
+@benchmark('submission_detail_context')
+def submission_detail_context_benchmark(size):
+    submission = create_submission(create_quiz(size))
+    submission.grade_mcq_msq()
+    yield lambda: submission_detail_context(submission.user, submission.pk)
+
+
+@benchmark('submission_detail_render')
+def submission_detail_render_benchmark(size):
+    submission = create_submission(create_quiz(size))
+    submission.grade_mcq_msq()
+    request = RequestFactory().get(f'/quizzes/submission/{submission.pk}/')
+    request.user = submission.user
+    context = submission_detail_context(submission.user, submission.pk)
+    yield lambda: render_to_string('quiz/submission_detail.html', context, request)
+
+
+def measure(run, repeat):
+    """
+    Returns the timings (ms), query count and allocations (KiB) of `run`.
+    """
+    run()
+
+    # The query log keeps the last 9000 queries only; once it is full the captures
+    # below would see none, so it is emptied first.
+    reset_queries()
+    with ExitStack() as stack:
+        captures = [stack.enter_context(CaptureQueriesContext(connection)) for connection in connections.all()]
+        run()
+    queries = sum(len(capture.captured_queries) for capture in captures)
+
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        run()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # As in timeit, garbage collection is paused so it does not land in one run.
+    timings = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'min_ms': round(min(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': queries,
+        'peak_alloc_kib': round((peak - baseline) / 1024, 1),
+        'retained_kib': round((current - baseline) / 1024, 1),
+    }
+
+
+def run_benchmarks(names, sizes, repeat):
+    """
+    Runs the named benchmarks at every size and returns their results keyed by
+    "<name>[<size>]".
+    """
+    results = {}
+    for name in names:
+        for size in sizes:
+            with BENCHMARKS[name](size) as run:
+                results[f"{name}[{size}]"] = {'benchmark': name, 'size': size, **measure(run, repeat)}
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Compares results with a baseline. A benchmark regresses when its fastest run or
+    its peak allocations grew by more than `threshold` (a fraction), or when it runs
+    more queries. The fastest run is compared rather than the median, as it is the
+    least sensitive to noise from other processes. Returns a list of human-readable
+    descriptions.
+    """
+    regressions = []
+    for key, result in results.items():
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        for metric in ('min_ms', 'peak_alloc_kib'):
+            if expected[metric] and result[metric] > expected[metric] * (1 + threshold):
+                regressions.append(
+                    f"{key}: {metric} {result[metric]} > baseline {expected[metric]} (+{result[metric] / expected[metric] - 1:.0%})"
+                )
+        if result['queries'] > expected['queries']:
+            regressions.append(f"{key}: queries {result['queries']} > baseline {expected['queries']}")
+    return regressions
@@ -0,0 +1,27 @@
+from django import forms
+from .models import UserAnswer
+
+
+class CodeAnswerGradeForm(forms.ModelForm):
+    """
+    Grades a single coding answer from the grade-by-question workspace.
+    Points are bounded by the question's maximum.
+    """
+    class Meta:
+        model = UserAnswer
+        fields = ('points_awarded', 'feedback')
+        widgets = {
+            'points_awarded': forms.NumberInput(attrs={'step': 'any', 'class': 'grade-points'}),
+            'feedback': forms.Textarea(attrs={'rows': 3, 'cols': 60}),
+        }
+
+    def __init__(self, *args, max_points=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_points = max_points
+        self.fields['points_awarded'].widget.attrs.update({'min': 0, 'max': max_points})
+
+    def clean_points_awarded(self):
+        points = self.cleaned_data['points_awarded']
+        if points is not None and not 0 <= points <= self.max_points:
+            raise forms.ValidationError(f"Points must be between 0 and {self.max_points}.")
+        return points
@@ -0,0 +1,82 @@
+from datetime import datetime, time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from quiz.models import ArchivedSubmission, QuizSubmission, UserAnswer
+
+class Command(BaseCommand):
+    """
+    A Django management command that moves old completed submissions to the archive.
+
+    Submissions that are COMPLETED and were started before the given date are copied,
+    together with their answers and selected choices, into ArchivedSubmission rows and
+    then deleted from the hot tables (their UserAnswer and selected-choice rows go
+    with them). The work is streamed in batches, each in its own transaction, so the
+    command can be interrupted and re-run safely.
+
+    Usage:
+        python manage.py archive_submissions --before 2025-01-01 [--batch-size 500] [--dry-run]
+    """
+    help = 'Archives completed submissions started before a given date.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', required=True, help='Archive submissions started before this date (YYYY-MM-DD).')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of submissions archived per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many submissions would be archived.')
+
+    def handle(self, *args, **options):
+        try:
+            before = datetime.strptime(options['before'], '%Y-%m-%d')
+        except ValueError:
+            raise CommandError('Error: --before must be a date in YYYY-MM-DD format.')
+        cutoff = timezone.make_aware(datetime.combine(before, time.min))
+
+        candidates = QuizSubmission.objects.filter(
+            status=QuizSubmission.SubmissionStatus.COMPLETED,
+            start_time__lt=cutoff,
+        )
+        if options['dry_run']:
+            self.stdout.write(f'{candidates.count()} submission(s) would be archived.')
+            return
+
+        archived_count = 0
+        last_id = None
+        while True:
+            batch = candidates.order_by('pk')
+            if last_id is not None:
+                batch = batch.filter(pk__gt=last_id)
+            batch = list(batch[:options['batch_size']])
+            if not batch:
+                break
+            archived_count += self.archive_batch(batch)
+            last_id = batch[-1].pk
+            self.stdout.write(f'  Archived {archived_count} submission(s)...')
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully archived {archived_count} submission(s).'))
+
+    @transaction.atomic
+    def archive_batch(self, submissions):
+        """
+        Archives one batch of submissions and deletes them from the hot tables.
+        Returns the number of submissions archived.
+        """
+        answers_by_submission = {submission.pk: [] for submission in submissions}
+        answers = UserAnswer.objects.filter(submission__in=submissions).order_by('question__order')
+        for answer in answers:
+            answers_by_submission[answer.submission_id].append(answer)
+
+        selected_choices = {}
+        through_rows = UserAnswer.selected_choices.through.objects.filter(
+            useranswer__submission__in=submissions
+        ).values_list('useranswer_id', 'choice_id')
+        for answer_id, choice_id in through_rows:
+            selected_choices.setdefault(answer_id, []).append(choice_id)
+
+        ArchivedSubmission.objects.bulk_create(
+            [
+                ArchivedSubmission.from_submission(submission, answers_by_submission[submission.pk], selected_choices)
+                for submission in submissions
+            ],
+        )
+        QuizSubmission.objects.filter(pk__in=[submission.pk for submission in submissions]).delete()
+        return len(submissions)
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from quiz import admission
+from quiz.views import process_spooled_submission
+
+class Command(BaseCommand):
+    """
+    A Django management command that persists submissions left in the local spool.
+
+    Web workers drain the spool themselves in a background thread; this command is for
+    entries left behind when a worker stopped, e.g. on deploys or crashes. Entries
+    claimed by a worker more than --reclaim-after seconds ago are put back first.
+
+    Usage:
+        python manage.py drain_submission_spool [--reclaim-after 300]
+    """
+    help = 'Persists quiz submissions waiting in the local submission spool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reclaim-after', type=float, default=300,
+            help='Re-process entries claimed by a worker more than this many seconds ago.',
+        )
+
+    def handle(self, *args, **options):
+        reclaimed = admission.reclaim_stale(options['reclaim_after'])
+        if reclaimed:
+            self.stdout.write(self.style.WARNING(f'Reclaimed {reclaimed} stale spool entry(ies).'))
+        processed = admission.drain(process_spooled_submission)
+        failed = admission.counters['failed_total']
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} spooled submission(s), {failed} failed.'))
@@ -0,0 +1,55 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from quiz.models import QuizSubmission, grade_submissions
+
+class Command(BaseCommand):
+    """
+    A Django management command that closes quiz attempts whose deadline has passed.
+
+    Overdue IN_PROGRESS submissions are located through the (status, deadline) index,
+    locked in batches (skipping rows a late POST is still writing), and graded with
+    whatever answers they contain. Answers received in time but still waiting in a
+    submission spool are recorded, and the attempt regraded, when they are drained
+    (see process_submission). By default the command runs as a daemon, sweeping
+    every --interval seconds; pass --once to run a single sweep, e.g. from cron.
+
+    Usage:
+        python manage.py expire_submissions [--once] [--interval 30] [--batch-size 500]
+    """
+    help = 'Finalizes and grades IN_PROGRESS submissions whose deadline has passed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single sweep and exit.')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds to wait between sweeps.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of submissions graded per transaction.')
+
+    def handle(self, *args, **options):
+        while True:
+            expired_count = self.sweep(options['batch_size'])
+            if expired_count:
+                self.stdout.write(self.style.SUCCESS(f'Expired {expired_count} submission(s).'))
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+    def sweep(self, batch_size):
+        """
+        Expires every overdue submission, one batch per transaction, and returns
+        the number of submissions expired.
+        """
+        cutoff = timezone.now() - settings.QUIZ_DEADLINE_GRACE_PERIOD
+        expired_count = 0
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    QuizSubmission.objects.select_for_update(skip_locked=True)
+                    .filter(status=QuizSubmission.SubmissionStatus.IN_PROGRESS, deadline__lt=cutoff)
+                    .order_by('deadline')[:batch_size]
+                )
+                grade_submissions(batch)
+            expired_count += len(batch)
+            if len(batch) < batch_size:
+                return expired_count
@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand
+from quiz.similarity import index_pending
+
+class Command(BaseCommand):
+    """
+    A Django management command that indexes new coding answers for near-duplicate detection.
+
+    Every coding answer without a MinHash signature is signed and assigned to a
+    cluster of near-duplicates of its question (see quiz.similarity); clusters are
+    shown in the admin grading pages, which do not index answers themselves.
+    Already indexed answers are never revisited, so each sweep only costs work
+    proportional to the answers submitted since the previous one. By default
+    the command runs as a daemon, sweeping every --interval seconds; pass --once to
+    run a single sweep, e.g. from cron.
+
+    Usage:
+        python manage.py index_code_similarity [--once] [--interval 60] [--batch-size 500]
+    """
+    help = 'Indexes new coding answers into clusters of near-duplicates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single sweep and exit.')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds to wait between sweeps.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of answers indexed per transaction.')
+
+    def handle(self, *args, **options):
+        while True:
+            indexed_count, duplicate_count = index_pending(batch_size=options['batch_size'])
+            if indexed_count:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Indexed {indexed_count} answer(s), {duplicate_count} similar to an earlier answer.'
+                ))
+            if options['once']:
+                break
+            time.sleep(options['interval'])
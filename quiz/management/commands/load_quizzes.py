@@ -2,7 +2,7 @@ import json
 from datetime import timedelta
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from quiz.models import Quiz, Question, Choice
+from quiz.models import Quiz, Question, Choice, deferred_quiz_touches
 
 class Command(BaseCommand):
     """
@@ -52,13 +52,15 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR('Error: The JSON file is not in the expected format (a list of quizzes or a dictionary with a "quizzes" key).'))
             return
 
-        # Clear existing data to avoid duplication
-        self.stdout.write(self.style.WARNING('Clearing existing quiz data...'))
-        Quiz.objects.all().delete()
+        # Saving questions and choices touches their quiz; do it once at the end.
+        with deferred_quiz_touches():
+            # Clear existing data to avoid duplication
+            self.stdout.write(self.style.WARNING('Clearing existing quiz data...'))
+            Quiz.objects.all().delete()
 
-        # Load new data
-        for quiz_data in quizzes_data:
-            self.create_quiz_from_data(quiz_data)
+            # Load new data
+            for quiz_data in quizzes_data:
+                self.create_quiz_from_data(quiz_data)
 
         self.stdout.write(self.style.SUCCESS('Successfully loaded all quizzes.'))
 
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from quiz.models import Question, QuizSubmission, UserAnswer, pack_choice_answers
+
+class Command(BaseCommand):
+    """
+    A Django management command that converts existing submissions to packed choice storage.
+
+    For every finished submission still storing its MCQ/MSQ answers as UserAnswer rows,
+    the selected choices are packed into `QuizSubmission.choice_answers`, the points
+    already awarded for them are kept in `choice_points`, and the UserAnswer rows (with
+    their selected-choice rows) are deleted. Coding answers are left untouched. The
+    work is done in batches, each in its own transaction, so the command can be
+    interrupted and re-run.
+
+    Usage:
+        python manage.py pack_choice_answers [--batch-size 500]
+    """
+    help = 'Converts MCQ/MSQ UserAnswer rows of existing submissions into packed choice answers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of submissions converted per transaction.')
+
+    def handle(self, *args, **options):
+        candidates = QuizSubmission.objects.filter(choice_answers__isnull=True).exclude(
+            status=QuizSubmission.SubmissionStatus.IN_PROGRESS
+        )
+        converted_count = 0
+        last_id = None
+        while True:
+            batch = candidates.order_by('pk')
+            if last_id is not None:
+                batch = batch.filter(pk__gt=last_id)
+            batch = list(batch.only('id', 'quiz_id')[:options['batch_size']])
+            if not batch:
+                break
+            self.pack_batch(batch)
+            converted_count += len(batch)
+            last_id = batch[-1].pk
+            self.stdout.write(f'  Converted {converted_count} submission(s)...')
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully converted {converted_count} submission(s).'))
+
+    @transaction.atomic
+    def pack_batch(self, submissions):
+        choice_answers = UserAnswer.objects.filter(submission__in=submissions).exclude(
+            question__question_type=Question.QuestionType.CODING
+        )
+        answers = {}
+        for answer_id, submission_id, question_id, points_awarded in choice_answers.values_list(
+            'id', 'submission_id', 'question_id', 'points_awarded'
+        ):
+            answers[answer_id] = (submission_id, question_id, points_awarded)
+
+        selected_by_submission = {submission.pk: {} for submission in submissions}
+        points_by_submission = {submission.pk: 0 for submission in submissions}
+        for submission_id, question_id, points_awarded in answers.values():
+            selected_by_submission[submission_id].setdefault(question_id, set())
+            points_by_submission[submission_id] += points_awarded or 0
+        through_rows = UserAnswer.selected_choices.through.objects.filter(
+            useranswer__in=choice_answers
+        ).values_list('useranswer_id', 'choice_id')
+        for answer_id, choice_id in through_rows:
+            submission_id, question_id, _ = answers[answer_id]
+            selected_by_submission[submission_id][question_id].add(choice_id)
+
+        for submission in submissions:
+            submission.choice_answers = pack_choice_answers(selected_by_submission[submission.pk])
+            submission.choice_points = points_by_submission[submission.pk]
+        QuizSubmission.objects.bulk_update(submissions, ['choice_answers', 'choice_points'])
+        choice_answers.delete()
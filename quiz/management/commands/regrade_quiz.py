@@ -0,0 +1,40 @@
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from quiz.models import Question, Quiz, regrade_questions
+
+class Command(BaseCommand):
+    """
+    A Django management command that regrades a quiz's MCQ/MSQ answers.
+
+    Run it after correcting the correct choices (or points) of questions of a quiz
+    that already has submissions. Only the answers to the given questions (by
+    default, every MCQ/MSQ question of the quiz) are re-scored, in batches, and the
+    scores of the submissions whose points changed are recomputed in bulk.
+
+    Usage:
+        python manage.py regrade_quiz <quiz_id> [--question <question_id> ...] [--batch-size 2000]
+    """
+    help = 'Re-scores existing MCQ/MSQ answers of a quiz after its correct choices changed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_id', type=uuid.UUID, help='Id of the quiz to regrade.')
+        parser.add_argument('--question', type=uuid.UUID, action='append', help='Only regrade this question (repeatable).')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Number of submissions regraded per transaction.')
+
+    def handle(self, *args, **options):
+        try:
+            quiz = Quiz.objects.get(pk=options['quiz_id'])
+        except Quiz.DoesNotExist:
+            raise CommandError(f'Error: Quiz {options["quiz_id"]} does not exist.')
+
+        questions = quiz.questions.exclude(question_type=Question.QuestionType.CODING)
+        if options['question']:
+            questions = questions.filter(pk__in=options['question'])
+            missing = set(options['question']) - {question.pk for question in questions}
+            if missing:
+                raise CommandError(f'Error: No MCQ/MSQ question(s) {", ".join(map(str, missing))} in quiz "{quiz.title}".')
+
+        changed_count, rescored_count = regrade_questions(questions, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Regraded "{quiz.title}": {changed_count} answer(s) changed, {rescored_count} submission(s) rescored.'
+        ))
@@ -0,0 +1,89 @@
+import json
+import platform
+from pathlib import Path
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+from quiz.benchmarks import BENCHMARKS, find_regressions, run_benchmarks
+
+class Command(BaseCommand):
+    """
+    A Django management command that benchmarks the quiz hot paths.
+
+    Each benchmark (grading, score calculation, quiz import, and the submission detail
+    page's context building and template rendering) is run at every --sizes quiz
+    size, recording median/min/max wall time, query count and tracemalloc
+    allocations. The benchmarks run against freshly created test databases (in
+    memory with SQLite), which are destroyed afterwards; the configured databases
+    are not written to. Results are compared with the --baseline file; the command
+    fails when any benchmark regressed by more than --threshold, or runs more
+    queries.
+
+    The committed benchmarks/baseline.json was recorded with the default options.
+    Timings depend on the machine: re-record it with --save-baseline on the machine
+    that runs the comparison, and after an accepted slowdown, and commit the file.
+
+    Usage:
+        python manage.py run_benchmarks [--benchmark grade_mcq_msq ...] [--sizes 10,50,200]
+            [--repeat 5] [--output results.json] [--baseline benchmarks/baseline.json]
+            [--threshold 0.25] [--save-baseline]
+    """
+    help = 'Benchmarks grading, quiz import and the submission detail page against a stored baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--benchmark', action='append', choices=sorted(BENCHMARKS), help='Benchmark to run (repeatable). Defaults to all of them.')
+        parser.add_argument('--sizes', default='10,50,200', help='Comma-separated numbers of questions per quiz.')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs per benchmark and size.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'), help='Baseline JSON file to compare with.')
+        parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown or allocation growth, as a fraction of the baseline.')
+        parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline instead of comparing.')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('Error: --sizes must be a comma-separated list of integers.')
+        names = options['benchmark'] or sorted(BENCHMARKS)
+
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = run_benchmarks(names, sizes, options['repeat'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        report = {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+            },
+            'results': results,
+        }
+        for key, result in results.items():
+            self.stdout.write(
+                f"{key:40} {result['median_ms']:>10.3f} ms {result['queries']:>5} queries {result['peak_alloc_kib']:>10.1f} KiB peak"
+            )
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(report, indent=2))
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(report, indent=2))
+            self.stdout.write(self.style.SUCCESS(f'Saved baseline to {baseline_path}.'))
+            return
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f'No baseline at {baseline_path}; run with --save-baseline to create one.'))
+            return
+
+        baseline = json.loads(baseline_path.read_text())['results']
+        regressions = find_regressions(results, baseline, options['threshold'])
+        if regressions:
+            raise CommandError('Performance regressions:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_deadlines(apps, schema_editor):
+    QuizSubmission = apps.get_model('quiz', 'QuizSubmission')
+    Quiz = apps.get_model('quiz', 'Quiz')
+    quiz_duration = Quiz.objects.filter(pk=models.OuterRef('quiz_id')).values('duration')
+    QuizSubmission.objects.filter(deadline__isnull=True).update(
+        deadline=models.ExpressionWrapper(
+            models.F('start_time') + models.Subquery(quiz_duration, output_field=models.DurationField()),
+            output_field=models.DateTimeField(),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0002_alter_question_options_alter_quiz_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizsubmission',
+            name='deadline',
+            field=models.DateTimeField(blank=True, help_text='Start time plus the quiz duration', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='quizsubmission',
+            index=models.Index(fields=['status', 'deadline'], name='quiz_submission_expiry_idx'),
+        ),
+        migrations.RunPython(backfill_deadlines, migrations.RunPython.noop),
+    ]
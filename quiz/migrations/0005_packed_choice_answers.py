@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0004_archivedsubmission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedsubmission',
+            name='choice_answers',
+            field=models.JSONField(blank=True, help_text='Packed MCQ/MSQ answers, as on QuizSubmission', null=True),
+        ),
+        migrations.AddField(
+            model_name='quizsubmission',
+            name='choice_answers',
+            field=models.JSONField(blank=True, help_text='Question id -> ids of the selected choices', null=True),
+        ),
+        migrations.AddField(
+            model_name='quizsubmission',
+            name='choice_points',
+            field=models.FloatField(blank=True, help_text='Auto-graded points of the packed choice answers', null=True),
+        ),
+    ]
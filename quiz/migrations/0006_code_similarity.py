@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0005_packed_choice_answers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeSignature',
+            fields=[
+                ('answer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='code_signature', serialize=False, to='quiz.useranswer')),
+                ('minhash', models.BinaryField(blank=True)),
+                ('cluster_id', models.UUIDField(blank=True, help_text="Answer id of the cluster's representative", null=True)),
+                ('similarity', models.FloatField(blank=True, help_text="Estimated similarity to the cluster's representative", null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quiz.question')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question', 'cluster_id'], name='quiz_code_cluster_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CodeSignatureBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quiz.question')),
+                ('signature', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='quiz.codesignature')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question', 'bucket', 'band'], name='quiz_code_band_bucket_idx')],
+            },
+        ),
+    ]
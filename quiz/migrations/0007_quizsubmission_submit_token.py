@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:12
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0006_code_similarity'),
+    ]
+
+    operations = [
+        # Added without a default first: a callable default would be evaluated once
+        # and give every existing submission the same token. Existing submissions
+        # keep a NULL token; new ones get their own.
+        migrations.AddField(
+            model_name='quizsubmission',
+            name='submit_token',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='quizsubmission',
+            name='submit_token',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, null=True, unique=True),
+        ),
+    ]
@@ -1,9 +1,20 @@
+import json
 import uuid
-from django.db import models
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.db.models import Exists, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+# The Quiz.touch calls collected by an enclosing deferred_quiz_touches() block.
+_deferred_touches = ContextVar('deferred_quiz_touches', default=None)
+
 class Quiz(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=200)
@@ -15,6 +26,50 @@ class Quiz(models.Model):
     def __str__(self):
         return self.title
 
+    @classmethod
+    def touch(cls, **filters):
+        """
+        Bumps `updated_at` of the matching quizzes. Called when their questions or
+        choices are saved or deleted (see the signal receivers below), so `updated_at`
+        versions the whole exam paper. bulk_create(), bulk_update() and update() send
+        no signals: code changing questions or choices that way must call this itself.
+        """
+        pending = _deferred_touches.get()
+        if pending is not None:
+            pending.append(filters)
+            return
+        cls.objects.filter(**filters).update(updated_at=timezone.now())
+
+
+@contextmanager
+def deferred_quiz_touches():
+    """
+    Collects the Quiz.touch calls made inside the block and applies them with a
+    single UPDATE when it exits, instead of one per saved question or choice.
+    """
+    if _deferred_touches.get() is not None:
+        yield
+        return
+    pending = []
+    token = _deferred_touches.set(pending)
+    try:
+        yield
+    finally:
+        _deferred_touches.reset(token)
+    if not pending:
+        return
+    values_by_lookup = {}
+    condition = Q()
+    for filters in pending:
+        if len(filters) == 1:
+            (lookup, value), = filters.items()
+            values_by_lookup.setdefault(lookup, set()).add(value)
+        else:
+            condition |= Q(**filters)
+    for lookup, values in values_by_lookup.items():
+        condition |= Q(**{f'{lookup}__in': values})
+    Quiz.objects.filter(condition).update(updated_at=timezone.now())
+
 class Question(models.Model):
     class QuestionType(models.TextChoices):
         MCQ = 'MCQ', _('Multiple Choice')
@@ -41,7 +96,63 @@ class Choice(models.Model):
     is_correct = models.BooleanField(default=False)
 
     def __str__(self):
-        return f"{self.choice_text} for {self.question.id}"
+        return f"{self.choice_text} for {self.question_id}"
+
+# Signals rather than save()/delete() overrides, so queryset deletes (such as the
+# admin's "delete selected" action) and cascades also version the quiz.
+def _touch_question_quiz(sender, instance, **kwargs):
+    Quiz.touch(pk=instance.quiz_id)
+
+def _touch_choice_quiz(sender, instance, **kwargs):
+    Quiz.touch(questions=instance.question_id)
+
+post_save.connect(_touch_question_quiz, sender=Question, dispatch_uid='quiz_touch_question_save')
+post_delete.connect(_touch_question_quiz, sender=Question, dispatch_uid='quiz_touch_question_delete')
+post_save.connect(_touch_choice_quiz, sender=Choice, dispatch_uid='quiz_touch_choice_save')
+post_delete.connect(_touch_choice_quiz, sender=Choice, dispatch_uid='quiz_touch_choice_delete')
+
+class QuizSubmissionQuerySet(models.QuerySet):
+    def fully_graded(self):
+        """
+        Narrows the queryset to submissions where every coding answer has been
+        awarded points.
+        """
+        ungraded_code_answers = UserAnswer.objects.filter(
+            submission=OuterRef('pk'),
+            question__question_type=Question.QuestionType.CODING,
+            points_awarded__isnull=True,
+        )
+        return self.exclude(Exists(ungraded_code_answers))
+
+    def finalize_grades(self):
+        """
+        Sets the score of every submission awaiting manual grading to the sum of its
+        awarded points (including packed choice answers) and marks it as completed,
+        in a single UPDATE statement.
+        Returns the number of submissions finalized.
+        """
+        return self.filter(status=QuizSubmission.SubmissionStatus.SUBMITTED).update(
+            score=self._score_expression(),
+            status=QuizSubmission.SubmissionStatus.COMPLETED,
+        )
+
+    def recalculate_scores(self):
+        """
+        Sets the score of every submission to the sum of its awarded points (including
+        packed choice answers) in a single UPDATE statement, keeping its status.
+        Returns the number of submissions updated.
+        """
+        return self.update(score=self._score_expression())
+
+    @staticmethod
+    def _score_expression():
+        answer_totals = (
+            UserAnswer.objects.filter(submission=OuterRef('pk'))
+            .values('submission')
+            .annotate(total=Sum('points_awarded'))
+            .values('total')
+        )
+        return Coalesce(Subquery(answer_totals), Value(0.0)) + Coalesce(F('choice_points'), Value(0.0))
 
 class QuizSubmission(models.Model):
     class SubmissionStatus(models.TextChoices):
@@ -57,55 +168,52 @@ class QuizSubmission(models.Model):
     score = models.FloatField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=SubmissionStatus.choices, default=SubmissionStatus.IN_PROGRESS)
 
+    deadline = models.DateTimeField(null=True, blank=True, help_text="Start time plus the quiz duration")
+    # Packed storage for MCQ/MSQ answers (see pack_choice_answers). When set, choice
+    # questions have no UserAnswer rows; only coding answers do.
+    choice_answers = models.JSONField(null=True, blank=True, help_text="Question id -> ids of the selected choices")
+    choice_points = models.FloatField(null=True, blank=True, help_text="Auto-graded points of the packed choice answers")
+    # Idempotency key of the attempt, rendered into the quiz form: every POST of that
+    # form (double clicks, retries, auto-submit) resolves to this one submission.
+    submit_token = models.UUIDField(default=uuid.uuid4, unique=True, null=True, editable=False)
+
+    objects = QuizSubmissionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Lets the expiry sweeper find overdue IN_PROGRESS submissions without a table scan.
+            models.Index(fields=['status', 'deadline'], name='quiz_submission_expiry_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}'s submission for {self.quiz.title}"
 
+    def save(self, *args, **kwargs):
+        if self.deadline is None:
+            self.deadline = (self.start_time or timezone.now()) + self.quiz.duration
+        super().save(*args, **kwargs)
+
+    def is_past_deadline(self, now=None):
+        """
+        Returns True once the deadline, extended by QUIZ_DEADLINE_GRACE_PERIOD
+        to absorb network latency of the auto-submit, has passed.
+        """
+        now = now or timezone.now()
+        return now > self.deadline + settings.QUIZ_DEADLINE_GRACE_PERIOD
+
     def grade_mcq_msq(self):
         """
         Grades all MCQ and MSQ answers for this submission, updates the score,
         and sets the final status based on whether manual grading is required.
         """
-        auto_graded_score = 0
-        has_manual_questions = False
-
-        for answer in self.answers.all():
-            question = answer.question
-            points = 0
-
-            if question.question_type == Question.QuestionType.MCQ:
-                correct_choice = question.choices.filter(is_correct=True).first()
-                user_choice = answer.selected_choices.first()
-                if correct_choice and user_choice and correct_choice.id == user_choice.id:
-                    points = question.points
-            
-            elif question.question_type == Question.QuestionType.MSQ:
-                correct_choices = set(question.choices.filter(is_correct=True).values_list('id', flat=True))
-                selected_choices = set(answer.selected_choices.values_list('id', flat=True))
-                if correct_choices == selected_choices and correct_choices: # Ensure not empty
-                    points = question.points
-
-            elif question.question_type == Question.QuestionType.CODING:
-                has_manual_questions = True
-            
-            answer.points_awarded = points
-            answer.save()
-            auto_graded_score += points
-
-        self.score = auto_graded_score
-        if has_manual_questions:
-            self.status = self.SubmissionStatus.SUBMITTED
-        else:
-            self.status = self.SubmissionStatus.COMPLETED
-        
-        self.end_time = timezone.now()
-        self.save()
+        grade_submissions([self])
 
     def calculate_final_score(self):
         """
         Calculates and RETURNS the score for the submission by summing up the points
         awarded for all associated answers. This method does NOT save the object.
         """
-        total_points_awarded = 0
+        total_points_awarded = self.choice_points or 0
         for answer in self.answers.all():
             # Use `is not None` to correctly handle cases where points_awarded is 0.
             if answer.points_awarded is not None:
@@ -122,4 +230,370 @@ class UserAnswer(models.Model):
     feedback = models.TextField(blank=True, help_text="Feedback for coding questions")
 
     def __str__(self):
-        return f"Answer for Q{self.question.order} in submission {self.submission.id}"
\ No newline at end of file
+        return f"Answer for Q{self.question.order} in submission {self.submission_id}"
+
+class ArchivedSubmission(models.Model):
+    """
+    A completed submission moved out of the hot QuizSubmission/UserAnswer tables by
+    `manage.py archive_submissions`. The submission's own fields are kept as columns;
+    its answers are stored as one zlib-compressed JSON document laid out column-wise
+    (one array per UserAnswer field), so an archived attempt costs a single row.
+    """
+    PAYLOAD_VERSION = 1
+
+    id = models.UUIDField(primary_key=True, editable=False, help_text="Id of the original QuizSubmission")
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE)
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField(null=True, blank=True)
+    score = models.FloatField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=QuizSubmission.SubmissionStatus.choices)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    choice_answers = models.JSONField(null=True, blank=True, help_text="Packed MCQ/MSQ answers, as on QuizSubmission")
+    answers_payload = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-start_time'], name='quiz_archive_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}'s archived submission for {self.quiz.title}"
+
+    @classmethod
+    def from_submission(cls, submission, answers, selected_choices):
+        """
+        Builds (without saving) the archive row of a submission.
+
+        `answers` are the submission's UserAnswer rows and `selected_choices` maps
+        each answer id to the ids of its selected choices.
+        """
+        columns = {
+            'v': cls.PAYLOAD_VERSION,
+            'question_id': [],
+            'selected_choices': [],
+            'code_answer': [],
+            'points_awarded': [],
+            'feedback': [],
+        }
+        for answer in answers:
+            columns['question_id'].append(answer.question_id.hex)
+            columns['selected_choices'].append([choice_id.hex for choice_id in selected_choices.get(answer.id, ())])
+            columns['code_answer'].append(answer.code_answer)
+            columns['points_awarded'].append(answer.points_awarded)
+            columns['feedback'].append(answer.feedback)
+
+        return cls(
+            id=submission.id,
+            user_id=submission.user_id,
+            quiz_id=submission.quiz_id,
+            start_time=submission.start_time,
+            end_time=submission.end_time,
+            score=submission.score,
+            status=submission.status,
+            choice_answers=submission.choice_answers,
+            answers_payload=zlib.compress(json.dumps(columns, separators=(',', ':')).encode()),
+        )
+
+    def unpack_answers(self):
+        """
+        Returns the archived answers as unsaved UserAnswer instances, and a map of
+        question id to the set of selected choice ids.
+        """
+        columns = json.loads(zlib.decompress(self.answers_payload))
+        answers = []
+        selected_choice_ids = {}
+        for question_id, choice_ids, code_answer, points_awarded, feedback in zip(
+            columns['question_id'], columns['selected_choices'], columns['code_answer'],
+            columns['points_awarded'], columns['feedback'],
+        ):
+            question_id = uuid.UUID(question_id)
+            answers.append(UserAnswer(
+                submission_id=self.id,
+                question_id=question_id,
+                code_answer=code_answer,
+                points_awarded=points_awarded,
+                feedback=feedback,
+            ))
+            selected_choice_ids[question_id] = {uuid.UUID(choice_id) for choice_id in choice_ids}
+        return answers, selected_choice_ids
+
+
+class CodeSignature(models.Model):
+    """
+    MinHash signature of a coding answer, written by `quiz.similarity.index_answers`,
+    and the cluster of near-duplicate answers it belongs to. A cluster is identified
+    by the id of its representative, the first indexed answer of the cluster. An
+    empty signature (and no cluster) marks an answer too short to compare.
+    """
+    answer = models.OneToOneField(UserAnswer, primary_key=True, related_name='code_signature', on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    minhash = models.BinaryField(blank=True)
+    cluster_id = models.UUIDField(null=True, blank=True, help_text="Answer id of the cluster's representative")
+    similarity = models.FloatField(null=True, blank=True, help_text="Estimated similarity to the cluster's representative")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['question', 'cluster_id'], name='quiz_code_cluster_idx'),
+        ]
+
+    def __str__(self):
+        return f"Signature of answer {self.answer_id}"
+
+class CodeSignatureBand(models.Model):
+    """
+    One LSH band bucket of a cluster representative's CodeSignature. New answers to
+    the same question sharing a (band, bucket) are compared with the representative.
+    """
+    signature = models.ForeignKey(CodeSignature, related_name='bands', on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['question', 'bucket', 'band'], name='quiz_code_band_bucket_idx'),
+        ]
+
+
+def pack_choice_answers(selected_choices):
+    """
+    Packs MCQ/MSQ answers into the `choice_answers` format: a mapping of question id
+    (hex) to the sorted ids (hex) of the selected choices. Choice ids are stored
+    rather than positions, so adding or deleting choices later does not change which
+    choices an answer refers to. Unanswered questions are left out.
+
+    `selected_choices` maps question id -> selected choice ids.
+    """
+    return {
+        question_id.hex: sorted(choice_id.hex for choice_id in selected)
+        for question_id, selected in selected_choices.items() if selected
+    }
+
+
+def unpack_choice_answers(packed, choice_ids=None):
+    """
+    Reverses pack_choice_answers: returns a mapping of question id -> set of
+    selected choice ids.
+
+    When `choice_ids` (question id -> that question's choice ids) is given, choices
+    that no longer exist are dropped, as deleting a choice removes it from the
+    selections of UserAnswer rows.
+    """
+    selected_choices = {}
+    for question_hex, selected in packed.items():
+        question_id = uuid.UUID(question_hex)
+        selected_choices[question_id] = {uuid.UUID(choice_hex) for choice_hex in selected}
+        if choice_ids is not None:
+            selected_choices[question_id].intersection_update(choice_ids.get(question_id, ()))
+    return selected_choices
+
+
+def score_choice_answer(question_type, points, correct, selected):
+    """
+    Returns the points earned by one MCQ/MSQ answer, given the sets of correct and
+    selected choice ids.
+    """
+    if question_type == Question.QuestionType.MCQ:
+        # The earliest selected choice must be the question's earliest correct choice.
+        if correct and selected and min(correct) == min(selected):
+            return points
+    elif question_type == Question.QuestionType.MSQ:
+        if correct == selected and correct: # Ensure not empty
+            return points
+    return 0
+
+
+def grade_submissions(submissions):
+    """
+    Grades the MCQ and MSQ answers of many submissions at once, in a fixed number
+    of queries regardless of how many submissions or answers there are.
+
+    Choice answers are read from UserAnswer rows or, for submissions using packed
+    storage, from `choice_answers`. Each submission's score is set to its auto-graded
+    points and its status to SUBMITTED when it contains coding answers (which are
+    left for manual grading) or COMPLETED otherwise. Answers and submissions are
+    written with bulk updates.
+    """
+    submissions = list(submissions)
+    if not submissions:
+        return
+    quiz_ids = {submission.quiz_id for submission in submissions}
+
+    answers = list(
+        UserAnswer.objects.filter(submission__in=submissions)
+        .select_related('question')
+        .only('id', 'submission_id', 'points_awarded', 'question__question_type', 'question__points')
+    )
+    selected_choices = {}
+    through_rows = UserAnswer.selected_choices.through.objects.filter(
+        useranswer__submission__in=submissions
+    ).values_list('useranswer_id', 'choice_id')
+    for answer_id, choice_id in through_rows:
+        selected_choices.setdefault(answer_id, set()).add(choice_id)
+    correct_choices = {}
+    choice_ids = {}
+    choice_rows = Choice.objects.filter(question__quiz__in=quiz_ids).values_list('question_id', 'id', 'is_correct')
+    for question_id, choice_id, is_correct in choice_rows:
+        choice_ids.setdefault(question_id, []).append(choice_id)
+        if is_correct:
+            correct_choices.setdefault(question_id, set()).add(choice_id)
+
+    auto_graded_scores = {submission.pk: 0 for submission in submissions}
+    manual_submissions = set()
+    graded_answers = []
+    for answer in answers:
+        question = answer.question
+        if question.question_type == Question.QuestionType.CODING:
+            # Coding answers keep whatever the grader has awarded so far.
+            manual_submissions.add(answer.submission_id)
+            continue
+
+        points = score_choice_answer(
+            question.question_type, question.points,
+            correct_choices.get(question.id, set()), selected_choices.get(answer.id, set()),
+        )
+        answer.points_awarded = points
+        graded_answers.append(answer)
+        auto_graded_scores[answer.submission_id] += points
+
+    packed_submissions = [submission for submission in submissions if submission.choice_answers is not None]
+    if packed_submissions:
+        choice_questions = Question.objects.filter(
+            quiz__in={submission.quiz_id for submission in packed_submissions},
+        ).exclude(question_type=Question.QuestionType.CODING).values_list('id', 'question_type', 'points')
+        choice_questions = {question_id: (question_type, points) for question_id, question_type, points in choice_questions}
+        for submission in packed_submissions:
+            submission.choice_points = 0
+            for question_id, selected in unpack_choice_answers(submission.choice_answers, choice_ids).items():
+                if question_id not in choice_questions:
+                    continue
+                question_type, points = choice_questions[question_id]
+                submission.choice_points += score_choice_answer(
+                    question_type, points, correct_choices.get(question_id, set()), selected,
+                )
+            auto_graded_scores[submission.pk] += submission.choice_points
+
+    end_time = timezone.now()
+    for submission in submissions:
+        submission.score = auto_graded_scores[submission.pk]
+        if submission.pk in manual_submissions:
+            submission.status = QuizSubmission.SubmissionStatus.SUBMITTED
+        else:
+            submission.status = QuizSubmission.SubmissionStatus.COMPLETED
+        submission.end_time = end_time
+
+    UserAnswer.objects.bulk_update(graded_answers, ['points_awarded'], batch_size=1000)
+    QuizSubmission.objects.bulk_update(submissions, ['score', 'status', 'end_time', 'choice_points'], batch_size=1000)
+
+
+def _correct_choice_answer_condition(question_type, correct):
+    """
+    Returns a UserAnswer filter matching the answers score_choice_answer awards
+    points to, given the question's set of correct choice ids, or None when no
+    answer can be correct.
+    """
+    if not correct:
+        return None
+    selected = UserAnswer.selected_choices.through.objects.filter(useranswer=OuterRef('pk'))
+    if question_type == Question.QuestionType.MCQ:
+        first_correct = min(correct)
+        return Q(Exists(selected.filter(choice=first_correct))) & ~Q(Exists(selected.filter(choice__lt=first_correct)))
+    condition = ~Q(Exists(selected.exclude(choice__in=correct)))
+    for choice_id in correct:
+        condition &= Q(Exists(selected.filter(choice=choice_id)))
+    return condition
+
+
+def regrade_questions(questions, batch_size=2000):
+    """
+    Re-scores the existing answers to MCQ/MSQ questions after their correct choices
+    (or points) were changed, e.g. when an instructor fixes a wrong `is_correct` flag.
+
+    Finished submissions of the questions' quizzes are processed in ranges of
+    `batch_size`, each in its own transaction. Answers stored as UserAnswer rows are
+    re-scored in SQL: per question, one UPDATE awards the points to the answers that
+    are now correct and one clears them from those that are not, touching only rows
+    whose points change. Packed choice answers have no per-question points, so the
+    `choice_points` of packed submissions are recomputed in Python from all of their
+    choice answers. The scores of a range are then recomputed with a single UPDATE.
+    IN_PROGRESS submissions are skipped (they are graded with the corrected choices on
+    submit), and archived submissions are not regraded.
+
+    Returns the number of answers and packed submissions whose points changed, and
+    the number of submissions rescored.
+    """
+    questions = [question for question in questions if question.question_type != Question.QuestionType.CODING]
+    if not questions:
+        return 0, 0
+    quiz_ids = {question.quiz_id for question in questions}
+
+    # Packed submissions are re-scored against every choice question of their quiz.
+    choice_questions = {}
+    correct_choices = {}
+    choice_ids = {}
+    for question_id, quiz_id, question_type, points in Question.objects.filter(quiz__in=quiz_ids).exclude(
+        question_type=Question.QuestionType.CODING
+    ).values_list('id', 'quiz_id', 'question_type', 'points'):
+        choice_questions[question_id] = (quiz_id, question_type, points)
+    for question_id, choice_id, is_correct in Choice.objects.filter(question__in=choice_questions).values_list(
+        'question_id', 'id', 'is_correct'
+    ):
+        choice_ids.setdefault(question_id, []).append(choice_id)
+        if is_correct:
+            correct_choices.setdefault(question_id, set()).add(choice_id)
+    conditions = [
+        (question, _correct_choice_answer_condition(question.question_type, correct_choices.get(question.id, set())))
+        for question in questions
+    ]
+
+    submissions = QuizSubmission.objects.filter(quiz__in=quiz_ids).exclude(
+        status=QuizSubmission.SubmissionStatus.IN_PROGRESS
+    ).order_by('pk')
+    changed_count = rescored_count = 0
+    last_id = None
+    while True:
+        batch = submissions if last_id is None else submissions.filter(pk__gt=last_id)
+        if not batch.exists():
+            return changed_count, rescored_count
+        # Ranges are bounded by primary keys, so no long id lists are sent to the database.
+        upper_ids = list(batch.values_list('pk', flat=True)[batch_size - 1:batch_size])
+        upper_id = upper_ids[0] if upper_ids else None
+        if upper_id is not None:
+            batch = batch.filter(pk__lte=upper_id)
+
+        with transaction.atomic():
+            batch_changed_count = 0
+            for question, condition in conditions:
+                answers = UserAnswer.objects.filter(question=question, submission__in=batch)
+                if condition is None:
+                    batch_changed_count += answers.exclude(points_awarded=0).update(points_awarded=0)
+                    continue
+                batch_changed_count += answers.filter(condition).exclude(points_awarded=question.points).update(
+                    points_awarded=question.points
+                )
+                batch_changed_count += answers.exclude(condition).exclude(points_awarded=0).update(points_awarded=0)
+
+            submissions_by_choice_points = {}
+            for submission_id, quiz_id, packed, old_choice_points in batch.filter(choice_answers__isnull=False).values_list(
+                'pk', 'quiz_id', 'choice_answers', 'choice_points'
+            ):
+                choice_points = 0
+                for question_id, selected in unpack_choice_answers(packed, choice_ids).items():
+                    if question_id in choice_questions and choice_questions[question_id][0] == quiz_id:
+                        _, question_type, points = choice_questions[question_id]
+                        choice_points += score_choice_answer(
+                            question_type, points, correct_choices.get(question_id, set()), selected,
+                        )
+                if choice_points != old_choice_points:
+                    submissions_by_choice_points.setdefault(choice_points, []).append(submission_id)
+            for choice_points, submission_ids in submissions_by_choice_points.items():
+                batch_changed_count += QuizSubmission.objects.filter(pk__in=submission_ids).update(choice_points=choice_points)
+
+            if batch_changed_count:
+                rescored_count += batch.recalculate_scores()
+            changed_count += batch_changed_count
+        last_id = upper_id
+        if upper_id is None:
+            return changed_count, rescored_count
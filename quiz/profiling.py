@@ -0,0 +1,178 @@
+"""
+Opt-in, per-request sampling profiler.
+
+A request is profiled when a staff user asks for it (the `X-Profile` header or the
+`_profile` query parameter), or when it is picked by 1-in-QUIZ_PROFILE_SAMPLE_RATE
+sampling. While the request runs, a background thread records the request thread's
+stack every QUIZ_PROFILE_INTERVAL seconds, and every SQL statement is timed. The
+result is written under QUIZ_PROFILE_DIR/<view name>/ as:
+
+    <profile id>.folded  collapsed stacks ("frame;frame;frame count" per line), the
+                         input format of flamegraph.pl and speedscope
+    <profile id>.json    request metadata and the executed SQL
+
+Only the QUIZ_PROFILE_MAX_PER_VIEW most recent profiles of each view are kept.
+Profiles are served to staff only, by the profile views; QUIZ_PROFILE_DIR must not
+be a publicly served directory such as MEDIA_ROOT.
+"""
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_PARAM = '_profile'
+
+# Upper bound on the SQL statements kept per profile.
+MAX_RECORDED_QUERIES = 1000
+
+
+def profiles_root():
+    return Path(settings.QUIZ_PROFILE_DIR)
+
+
+def view_directory_name(view_name):
+    # 'quiz:submission_detail' -> 'quiz.submission_detail'
+    return view_name.replace(':', '.').replace('/', '_')
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread from a background thread and counts each
+    distinct stack, root frame first.
+    """
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper recording each statement with its alias and duration.
+    """
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if len(self.queries) < MAX_RECORDED_QUERIES:
+                self.queries.append({
+                    'alias': self.alias,
+                    'sql': sql,
+                    'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+                })
+
+
+class ProfilingMiddleware:
+    """
+    Profiles selected requests and writes the results under QUIZ_PROFILE_DIR.
+    Must come after AuthenticationMiddleware, which provides `request.user`.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        # The flag is checked first so unflagged requests never load the user here.
+        if (
+            request.headers.get(PROFILE_HEADER) or request.GET.get(PROFILE_QUERY_PARAM)
+        ) and request.user.is_staff:
+            return True
+        sample_rate = settings.QUIZ_PROFILE_SAMPLE_RATE
+        return sample_rate > 0 and random.randrange(sample_rate) == 0
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        try:
+            view_name = resolve(request.path_info).view_name
+        except Resolver404:
+            return self.get_response(request)
+
+        recorders = [QueryRecorder(connection.alias) for connection in connections.all()]
+        sampler = StackSampler(threading.get_ident(), settings.QUIZ_PROFILE_INTERVAL)
+        started_at = timezone.now()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection, recorder in zip(connections.all(), recorders):
+                stack.enter_context(connection.execute_wrapper(recorder))
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                sampler.stop()
+        duration = time.perf_counter() - start
+
+        queries = [query for recorder in recorders for query in recorder.queries]
+        self.save_profile(view_name, request, response, started_at, duration, sampler.stacks, queries)
+        return response
+
+    def save_profile(self, view_name, request, response, started_at, duration, stacks, queries):
+        directory = profiles_root() / view_directory_name(view_name)
+        directory.mkdir(parents=True, exist_ok=True)
+        # Profile ids sort chronologically.
+        profile_id = f"{started_at:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+
+        with open(directory / f'{profile_id}.folded', 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(directory / f'{profile_id}.json', 'w') as f:
+            json.dump({
+                'id': profile_id,
+                'view_name': view_name,
+                'method': request.method,
+                'path': request.get_full_path(),
+                'user_id': request.user.pk,
+                'status_code': response.status_code,
+                'started_at': started_at.isoformat(),
+                'duration_ms': round(duration * 1000, 3),
+                'samples': sum(stacks.values()),
+                'sql_count': len(queries),
+                'sql_duration_ms': round(sum(query['duration_ms'] for query in queries), 3),
+                'sql': queries,
+            }, f, indent=2)
+        self.prune_profiles(directory)
+
+    def prune_profiles(self, directory):
+        """
+        Deletes the oldest profiles of a view beyond QUIZ_PROFILE_MAX_PER_VIEW.
+        """
+        profile_ids = sorted(path.stem for path in directory.glob('*.json'))
+        excess = len(profile_ids) - settings.QUIZ_PROFILE_MAX_PER_VIEW
+        for profile_id in profile_ids[:max(excess, 0)]:
+            for suffix in ('.json', '.folded'):
+                (directory / f'{profile_id}{suffix}').unlink(missing_ok=True)
@@ -0,0 +1,263 @@
+"""
+Near-duplicate detection for coding answers.
+
+Each answer is tokenized with identifiers, strings and numbers normalized (so renaming
+variables does not hide copying), cut into overlapping token shingles, and summarized
+by a MinHash signature. Signatures are computed with one-permutation hashing: every
+shingle is hashed once and assigned to one of SIGNATURE_SIZE bins that keeps its
+minimum, with empty bins filled from their right neighbour. The fraction of equal bins
+between two signatures estimates the Jaccard similarity of their shingle sets.
+
+Answers too short to yield a single shingle are not compared.
+
+Answers are grouped into clusters of near-duplicates by leader clustering: each new
+answer joins the cluster whose representative it is most similar to, provided the
+estimated similarity reaches QUIZ_SIMILARITY_THRESHOLD, or becomes the representative
+of a new cluster. Only representatives are split into LSH_BANDS bands; an answer is
+compared with the representatives sharing one of its band buckets. Indexing an answer
+therefore costs a few bucket lookups and comparisons, and storage grows linearly with
+the number of answers, even when hundreds of them are identical. Answers are indexed
+incrementally as they arrive, by `manage.py index_code_similarity`.
+"""
+import hashlib
+import io
+import keyword
+import logging
+import re
+import tokenize
+from array import array
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+
+from .models import CodeSignature, CodeSignatureBand, Question, UserAnswer
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_SIZE = 5
+SIGNATURE_SIZE = 128
+LSH_BANDS = 16
+LSH_ROWS = SIGNATURE_SIZE // LSH_BANDS
+
+_MASK64 = (1 << 64) - 1
+_FALLBACK_TOKEN_RE = re.compile(r"[A-Za-z_]\w*|\d+(?:\.\d+)?|\S")
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+def normalize_tokens(code):
+    """
+    Returns the normalized token stream of a piece of Python code: keywords and
+    operators are kept, other names become 'V', strings 'S' and numbers 'N'.
+    Comments and blank lines are dropped. Code that does not tokenize (e.g. a
+    syntax error) falls back to a regular-expression tokenizer.
+    """
+    tokens = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.NAME:
+                tokens.append(token.string if keyword.iskeyword(token.string) else 'V')
+            elif token.type == tokenize.STRING:
+                tokens.append('S')
+            elif token.type == tokenize.NUMBER:
+                tokens.append('N')
+            elif token.type == tokenize.OP:
+                tokens.append(token.string)
+            elif token.type in (tokenize.INDENT, tokenize.DEDENT):
+                tokens.append(tokenize.tok_name[token.type])
+        return tokens
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        pass
+
+    tokens = []
+    for value in _FALLBACK_TOKEN_RE.findall(code):
+        if value[0].isdigit():
+            tokens.append('N')
+        elif value[0].isalpha() or value[0] == '_':
+            tokens.append(value if keyword.iskeyword(value) else 'V')
+        else:
+            tokens.append(value)
+    return tokens
+
+
+def shingle_hashes(tokens):
+    """
+    Returns the set of 64-bit hashes of all SHINGLE_SIZE-token windows.
+    """
+    return {
+        _hash64('\x1f'.join(tokens[i:i + SHINGLE_SIZE]).encode())
+        for i in range(len(tokens) - SHINGLE_SIZE + 1)
+    }
+
+
+def minhash(hashes):
+    """
+    Computes the one-permutation MinHash signature of a set of shingle hashes, or
+    None when there are no shingles (answers too short to compare).
+    """
+    if not hashes:
+        return None
+    bins = [None] * SIGNATURE_SIZE
+    for value in hashes:
+        index = value % SIGNATURE_SIZE
+        value //= SIGNATURE_SIZE
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+    # Densify: an empty bin borrows the value of the next non-empty bin to its right,
+    # mixed with the distance so borrowed values only match equally borrowed ones.
+    signature = []
+    for index in range(SIGNATURE_SIZE):
+        distance = 0
+        while bins[(index + distance) % SIGNATURE_SIZE] is None:
+            distance += 1
+        value = bins[(index + distance) % SIGNATURE_SIZE]
+        signature.append((value + distance * 0x9E3779B97F4A7C15) & _MASK64 if distance else value)
+    return signature
+
+
+def estimated_similarity(signature_a, signature_b):
+    return sum(a == b for a, b in zip(signature_a, signature_b)) / SIGNATURE_SIZE
+
+
+def band_buckets(signature):
+    """
+    Yields (band, bucket) for each LSH band of a signature. Buckets are signed
+    64-bit integers so they fit a BigIntegerField.
+    """
+    for band in range(LSH_BANDS):
+        rows = array('Q', signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]).tobytes()
+        yield band, int.from_bytes(hashlib.blake2b(rows, digest_size=8).digest(), 'big', signed=True)
+
+
+def encode_signature(signature):
+    return array('Q', signature).tobytes() if signature else b''
+
+
+def decode_signature(data):
+    return list(array('Q', bytes(data))) if data else None
+
+
+@transaction.atomic
+def index_answers(answers):
+    """
+    Signs a batch of not yet indexed coding answers and assigns each one to a
+    cluster (see the module docstring). Returns the number of answers that joined
+    an existing cluster.
+    """
+    signatures = []
+    signed = []
+    for answer in answers:
+        signature = minhash(shingle_hashes(normalize_tokens(answer.code_answer or '')))
+        code_signature = CodeSignature(answer_id=answer.id, question_id=answer.question_id, minhash=encode_signature(signature))
+        signatures.append(code_signature)
+        if signature is not None:
+            keys = [(answer.question_id, band, bucket) for band, bucket in band_buckets(signature)]
+            signed.append((code_signature, signature, keys))
+
+    # The representatives indexed so far that share a bucket with a new answer.
+    representatives_by_key = {}
+    representative_signatures = {}
+    if signed:
+        keys = {key for _, _, answer_keys in signed for key in answer_keys}
+        matches = CodeSignatureBand.objects.filter(
+            question_id__in={question_id for question_id, _, _ in keys},
+            bucket__in={bucket for _, _, bucket in keys},
+        ).values_list('question_id', 'band', 'bucket', 'signature_id')
+        for question_id, band, bucket, answer_id in matches:
+            if (question_id, band, bucket) in keys:
+                representatives_by_key.setdefault((question_id, band, bucket), []).append(answer_id)
+        representative_signatures = {
+            answer_id: decode_signature(data)
+            for answer_id, data in CodeSignature.objects.filter(
+                answer_id__in={answer_id for answer_ids in representatives_by_key.values() for answer_id in answer_ids}
+            ).values_list('answer_id', 'minhash')
+        }
+
+    threshold = settings.QUIZ_SIMILARITY_THRESHOLD
+    bands = []
+    duplicate_count = 0
+    for code_signature, signature, keys in signed:
+        candidates = {answer_id for key in keys for answer_id in representatives_by_key.get(key, ())}
+        best_id, best_similarity = None, 0
+        for answer_id in sorted(candidates):
+            similarity = estimated_similarity(signature, representative_signatures[answer_id])
+            if similarity >= threshold and similarity > best_similarity:
+                best_id, best_similarity = answer_id, similarity
+        if best_id is not None:
+            code_signature.cluster_id, code_signature.similarity = best_id, best_similarity
+            duplicate_count += 1
+            continue
+        # A new representative, which later answers of this batch are compared with too.
+        code_signature.cluster_id, code_signature.similarity = code_signature.answer_id, 1.0
+        representative_signatures[code_signature.answer_id] = signature
+        for key in keys:
+            representatives_by_key.setdefault(key, []).append(code_signature.answer_id)
+            bands.append(CodeSignatureBand(signature=code_signature, question_id=key[0], band=key[1], bucket=key[2]))
+    CodeSignature.objects.bulk_create(signatures)
+    CodeSignatureBand.objects.bulk_create(bands, batch_size=1000)
+    return duplicate_count
+
+
+def unindexed_answers():
+    return UserAnswer.objects.filter(
+        question__question_type=Question.QuestionType.CODING,
+        code_signature__isnull=True,
+    )
+
+
+def index_pending(answers=None, batch_size=500):
+    """
+    Indexes every not yet indexed coding answer in `answers` (all of them by
+    default), one batch per transaction. Returns (answers indexed, answers that
+    joined an existing cluster).
+    """
+    if answers is None:
+        answers = unindexed_answers()
+    indexed_count = duplicate_count = 0
+    while True:
+        batch = list(answers.filter(code_signature__isnull=True).only('id', 'question_id', 'code_answer').order_by('pk')[:batch_size])
+        if not batch:
+            return indexed_count, duplicate_count
+        try:
+            duplicate_count += index_answers(batch)
+        except IntegrityError:
+            # Another indexer signed some of these answers first; they are no
+            # longer pending, so the next batch skips them.
+            logger.warning("Answers %s..%s were indexed concurrently; retrying the batch.", batch[0].pk, batch[-1].pk)
+            continue
+        indexed_count += len(batch)
+
+
+def cluster_sizes(question, cluster_ids=None):
+    """
+    Returns a mapping of cluster id -> number of answers of the question's clusters
+    with more than one answer, optionally limited to `cluster_ids`.
+    """
+    signatures = CodeSignature.objects.filter(question=question, cluster_id__isnull=False)
+    if cluster_ids is not None:
+        signatures = signatures.filter(cluster_id__in=cluster_ids)
+    return dict(
+        signatures.values('cluster_id').annotate(size=Count('pk')).filter(size__gt=1).values_list('cluster_id', 'size')
+    )
+
+
+def similar_clusters(question):
+    """
+    Groups the answers to a question into its clusters of near-duplicates. Returns a
+    list of (cluster id, answer ids, lowest similarity to the representative),
+    largest clusters first; answers without near-duplicates are left out.
+    """
+    sizes = cluster_sizes(question)
+    clusters = {}
+    rows = CodeSignature.objects.filter(question=question, cluster_id__in=list(sizes)).values_list('cluster_id', 'answer_id', 'similarity')
+    for cluster_id, answer_id, similarity in rows:
+        answer_ids, lowest_similarity = clusters.get(cluster_id, ([], 1.0))
+        answer_ids.append(answer_id)
+        clusters[cluster_id] = (answer_ids, min(lowest_similarity, similarity))
+    return sorted(
+        ((cluster_id, answer_ids, similarity) for cluster_id, (answer_ids, similarity) in clusters.items()),
+        key=lambda cluster: (-len(cluster[1]), -cluster[2]),
+    )
@@ -1,3 +1,916 @@
-from django.test import TestCase
+import json
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from core.db_router import REPLICA_ALIAS, SESSION_PIN_KEY, ReplicaRouter, use_replica
+from .models import (
+    Quiz, Question, Choice, QuizSubmission, UserAnswer, ArchivedSubmission, CodeSignature, CodeSignatureBand,
+    deferred_quiz_touches, grade_submissions, pack_choice_answers, regrade_questions, score_choice_answer,
+    unpack_choice_answers,
+)
+from . import admission
+from .benchmarks import BENCHMARKS, find_regressions
+from .similarity import LSH_BANDS, estimated_similarity, index_pending, similar_clusters
+from .views import process_spooled_submission, submission_detail_context
 
-# Create your tests here.
+# Pages are rendered without running collectstatic first, so the manifest storage
+# used in production cannot resolve static files in tests.
+TEST_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+def create_quiz(title='Quiz', mcq=2, msq=1, code=1, points=2.0):
+    """
+    Creates a quiz with the given number of questions of each type. Choice questions
+    get four choices; the first one is correct, and for MSQs the second one as well.
+    """
+    quiz = Quiz.objects.create(title=title, duration=timedelta(minutes=30))
+    order = 0
+    for question_type, count in (
+        (Question.QuestionType.MCQ, mcq),
+        (Question.QuestionType.MSQ, msq),
+        (Question.QuestionType.CODING, code),
+    ):
+        for number in range(count):
+            question = Question.objects.create(
+                quiz=quiz, question_text=f'{question_type} {number}', question_type=question_type,
+                points=points, order=order,
+            )
+            order += 1
+            if question_type == Question.QuestionType.CODING:
+                continue
+            for index in range(4):
+                Choice.objects.create(
+                    question=question, choice_text=f'Choice {index}',
+                    is_correct=index == 0 or (index == 1 and question_type == Question.QuestionType.MSQ),
+                )
+    return quiz
+
+
+def correct_choices(question):
+    return list(question.choices.filter(is_correct=True))
+
+
+def wrong_choices(question):
+    return list(question.choices.filter(is_correct=False).order_by('choice_text')[:1])
+
+
+def create_submission(quiz, user, correct=True, code='print("hello")', status=None):
+    """
+    Creates a submission answering every question of `quiz`, correctly or not,
+    with one UserAnswer row per question.
+    """
+    submission = QuizSubmission.objects.create(user=user, quiz=quiz)
+    for question in quiz.questions.all():
+        answer = UserAnswer.objects.create(submission=submission, question=question)
+        if question.question_type == Question.QuestionType.CODING:
+            answer.code_answer = code
+            answer.save()
+        else:
+            answer.selected_choices.set(correct_choices(question) if correct else wrong_choices(question))
+    if status is not None:
+        submission.status = status
+        submission.save()
+    return submission
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+
+    def test_admin_action_pins_session_to_primary(self):
+        quiz = create_quiz()
+        submission = create_submission(quiz, self.admin, status=QuizSubmission.SubmissionStatus.SUBMITTED)
+        response = self.client.post(reverse('admin:quiz_quizsubmission_changelist'), {
+            'action': 'finalize_grades',
+            '_selected_action': [str(submission.pk)],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertGreater(self.client.session[SESSION_PIN_KEY], time.time())
+        submission.refresh_from_db()
+        self.assertEqual(submission.status, QuizSubmission.SubmissionStatus.COMPLETED)
+
+    def test_change_form_save_pins_session_to_primary(self):
+        quiz = create_quiz()
+        response = self.client.post(reverse('admin:quiz_quiz_change', args=[quiz.pk]), {
+            'title': 'Renamed quiz',
+            'description': '',
+            'duration': '00:30:00',
+        })
+        self.assertRedirects(response, reverse('admin:quiz_quiz_changelist'), fetch_redirect_response=False)
+        self.assertGreater(self.client.session[SESSION_PIN_KEY], time.time())
+        self.assertContains(self.client.get(response.url), 'Renamed quiz')
+
+    def test_grading_save_pins_session_to_primary(self):
+        quiz = create_quiz(mcq=0, msq=0, code=1)
+        answer = create_submission(quiz, self.admin).answers.get()
+        url = reverse('admin:quiz_question_grade', args=[answer.question_id])
+        response = self.client.post(url, {
+            'answer_ids': [str(answer.pk)],
+            f'{answer.pk}-points_awarded': 1,
+            f'{answer.pk}-feedback': '',
+            '_save': '1',
+        })
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertGreater(self.client.session[SESSION_PIN_KEY], time.time())
+
+    def test_changelist_get_does_not_pin(self):
+        self.client.get(reverse('admin:quiz_quizsubmission_changelist'))
+        self.assertNotIn(SESSION_PIN_KEY, self.client.session)
+
+
+class ReplicaRouterTests(TransactionTestCase):
+    databases = {'default', REPLICA_ALIAS}
+
+    def test_reads_use_replica_only_inside_block(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(QuizSubmission), 'default')
+        with use_replica():
+            self.assertEqual(router.db_for_read(QuizSubmission), REPLICA_ALIAS)
+            # Auth and sessions always stay on the primary.
+            self.assertEqual(router.db_for_read(User), 'default')
+        self.assertEqual(router.db_for_write(QuizSubmission), 'default')
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class ArchiveSubmissionsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student', password='password')
+        self.quiz = create_quiz()
+        self.old = create_submission(self.quiz, self.user, code='print("archived")')
+        self.old.grade_mcq_msq()
+        UserAnswer.objects.filter(submission=self.old, question__question_type=Question.QuestionType.CODING).update(
+            points_awarded=1.5, feedback='Nice',
+        )
+        QuizSubmission.objects.filter(pk=self.old.pk).finalize_grades()
+        QuizSubmission.objects.filter(pk=self.old.pk).update(start_time=timezone.now() - timedelta(days=400))
+        self.old.refresh_from_db()
+        self.recent = create_submission(self.quiz, self.user, status=QuizSubmission.SubmissionStatus.COMPLETED)
+
+    def archive(self, *args):
+        call_command('archive_submissions', '--before', (timezone.now() - timedelta(days=30)).strftime('%Y-%m-%d'), *args, stdout=StringIO())
+
+    def test_dry_run_keeps_submissions(self):
+        self.archive('--dry-run')
+        self.assertEqual(QuizSubmission.objects.count(), 2)
+        self.assertFalse(ArchivedSubmission.objects.exists())
+
+    def test_archives_old_completed_submissions_with_their_answers(self):
+        selected = {
+            answer.question_id: {choice.pk for choice in answer.selected_choices.all()}
+            for answer in self.old.answers.all()
+        }
+        self.archive('--batch-size', '1')
+
+        self.assertFalse(QuizSubmission.objects.filter(pk=self.old.pk).exists())
+        self.assertFalse(UserAnswer.objects.filter(submission_id=self.old.pk).exists())
+        self.assertTrue(QuizSubmission.objects.filter(pk=self.recent.pk).exists())
+
+        archived = ArchivedSubmission.objects.get(pk=self.old.pk)
+        self.assertEqual(archived.score, self.old.score)
+        answers, archived_selected = archived.unpack_answers()
+        code_answer = next(answer for answer in answers if answer.code_answer)
+        self.assertEqual((code_answer.code_answer, code_answer.points_awarded, code_answer.feedback), ('print("archived")', 1.5, 'Nice'))
+        self.assertEqual({question_id: choices for question_id, choices in archived_selected.items() if choices}, {
+            question_id: choices for question_id, choices in selected.items() if choices
+        })
+
+    def test_archived_submission_stays_visible_to_its_owner(self):
+        self.archive()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('quiz:submission_detail', args=[self.old.pk]))
+        self.assertContains(response, 'print(&quot;archived&quot;)')
+        response = self.client.get(reverse('quiz:submission_history'))
+        self.assertEqual([submission.pk for submission in response.context['submissions']], [self.recent.pk, self.old.pk])
+
+        other = User.objects.create_user('other', password='password')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('quiz:submission_detail', args=[self.old.pk])).status_code, 404)
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class PackedChoiceAnswersTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student', password='password')
+        self.quiz = create_quiz()
+        self.questions = list(self.quiz.questions.exclude(question_type=Question.QuestionType.CODING))
+
+    def selected_by_question(self):
+        return {question.id: {choice.pk for choice in correct_choices(question)} for question in self.questions}
+
+    def test_unpack_is_stable_when_choices_change(self):
+        selected = self.selected_by_question()
+        packed = pack_choice_answers(selected)
+        # A new choice sorting before every existing one, and a deleted unselected one.
+        for index, question in enumerate(self.questions):
+            Choice.objects.create(id=uuid.UUID(int=index), question=question, choice_text='New')
+            wrong_choices(question)[0].delete()
+        choice_ids = {question.id: list(question.choices.values_list('pk', flat=True)) for question in self.questions}
+        self.assertEqual(unpack_choice_answers(packed, choice_ids), selected)
+
+    def test_unpack_drops_deleted_choices(self):
+        question = self.questions[0]
+        choice = correct_choices(question)[0]
+        packed = pack_choice_answers({question.id: {choice.pk}})
+        choice.delete()
+        choice_ids = {question.id: list(question.choices.values_list('pk', flat=True))}
+        self.assertEqual(unpack_choice_answers(packed, choice_ids), {question.id: set()})
+
+    def test_packing_keeps_scores_and_answers(self):
+        correct = create_submission(self.quiz, self.user)
+        wrong = create_submission(self.quiz, self.user, correct=False)
+        for submission in (correct, wrong):
+            submission.grade_mcq_msq()
+        detail_before = submission_detail_context(self.user, correct.pk)['questions_with_answers']
+
+        call_command('pack_choice_answers', '--batch-size', '1', stdout=StringIO())
+
+        self.assertFalse(UserAnswer.objects.exclude(question__question_type=Question.QuestionType.CODING).exists())
+        for submission in (correct, wrong):
+            score = submission.score
+            submission.refresh_from_db()
+            self.assertEqual(submission.score, score)
+        self.assertEqual(correct.choice_points, 6.0)
+        self.assertEqual(wrong.choice_points, 0)
+        detail_after = submission_detail_context(self.user, correct.pk)['questions_with_answers']
+        self.assertEqual(
+            [question['selected_choice_ids'] for question in detail_after],
+            [question['selected_choice_ids'] for question in detail_before],
+        )
+
+    def test_regrade_after_adding_choices_keeps_packed_scores(self):
+        submission = create_submission(self.quiz, self.user)
+        submission.grade_mcq_msq()
+        call_command('pack_choice_answers', stdout=StringIO())
+        for index, question in enumerate(self.questions):
+            Choice.objects.create(id=uuid.UUID(int=index), question=question, choice_text='New')
+
+        regrade_questions(self.questions)
+        submission.refresh_from_db()
+        self.assertEqual(submission.choice_points, 6.0)
+        detail = submission_detail_context(self.user, submission.pk)['questions_with_answers']
+        for question, data in zip(self.quiz.questions.all(), detail):
+            self.assertEqual(data['selected_choice_ids'], {choice.pk for choice in correct_choices(question)})
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class QuizVersionTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+        self.quiz = create_quiz()
+        Quiz.objects.update(updated_at=timezone.now() - timedelta(days=1))
+
+    def paper_etag(self):
+        return self.client.get(reverse('quiz:quiz_paper_api', args=[self.quiz.pk]))['ETag']
+
+    def test_admin_bulk_delete_changes_paper_etag(self):
+        etag = self.paper_etag()
+        question = self.quiz.questions.first()
+        response = self.client.post(reverse('admin:quiz_question_changelist'), {
+            'action': 'delete_selected',
+            '_selected_action': [str(question.pk)],
+            'post': 'yes',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Question.objects.filter(pk=question.pk).exists())
+        self.assertNotEqual(self.paper_etag(), etag)
+
+    def test_choice_queryset_delete_touches_quiz(self):
+        updated_at = Quiz.objects.get(pk=self.quiz.pk).updated_at
+        Choice.objects.filter(question__quiz=self.quiz, is_correct=False).delete()
+        self.assertGreater(Quiz.objects.get(pk=self.quiz.pk).updated_at, updated_at)
+
+    def test_deferred_touches_run_one_update(self):
+        other = create_quiz('Other')
+        Quiz.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        with CaptureQueriesContext(connection) as queries:
+            with deferred_quiz_touches():
+                for question in Question.objects.all():
+                    question.save()
+                    for choice in question.choices.all():
+                        choice.save()
+        quiz_updates = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE "quiz_quiz"')]
+        self.assertEqual(len(quiz_updates), 1)
+        for quiz in (self.quiz, other):
+            self.assertGreater(Quiz.objects.get(pk=quiz.pk).updated_at, timezone.now() - timedelta(minutes=1))
+
+    def test_load_quizzes_touches_quizzes_once(self):
+        data = {'quizzes': [{
+            'title': 'Loaded', 'time_limit_minutes': 10,
+            'questions': [
+                {'question_text': f'Question {index}', 'question_type': 'MCQ', 'order': index, 'choices': [
+                    {'choice_text': 'Yes', 'is_correct': True}, {'choice_text': 'No'},
+                ]}
+                for index in range(20)
+            ],
+        }]}
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(data, f)
+            f.flush()
+            with CaptureQueriesContext(connection) as queries:
+                call_command('load_quizzes', f.name, stdout=StringIO())
+        quiz_updates = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE "quiz_quiz"')]
+        self.assertEqual(len(quiz_updates), 1)
+        self.assertEqual(Quiz.objects.get().questions.count(), 20)
+
+
+@override_settings(STORAGES=TEST_STORAGES, QUIZ_PROFILE_MAX_PER_VIEW=2)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        override = override_settings(QUIZ_PROFILE_DIR=self.directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+
+    def test_profiles_are_pruned_and_served_to_staff_only(self):
+        for _ in range(4):
+            self.client.get(reverse('quiz:quiz_list'), headers={'X-Profile': '1'})
+        view_directory = Path(self.directory.name) / 'quiz.quiz_list'
+        self.assertEqual(len(list(view_directory.glob('*.json'))), 2)
+        self.assertEqual(len(list(view_directory.glob('*.folded'))), 2)
+
+        filename = sorted(view_directory.glob('*.json'))[-1].name
+        url = reverse('quiz:profile_file', args=['quiz.quiz_list', filename])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.force_login(User.objects.create_user('student', password='password'))
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+
+def answer_form(quiz, submission, correct=True):
+    """
+    Returns the POST data of the quiz form for `submission`, answering every question.
+    """
+    data = {'submit_token': submission.submit_token.hex}
+    for question in quiz.questions.all():
+        if question.question_type == Question.QuestionType.CODING:
+            data[f'question_{question.id}'] = 'print("hello")'
+        else:
+            choices = correct_choices(question) if correct else wrong_choices(question)
+            data[f'question_{question.id}'] = [str(choice.pk) for choice in choices]
+    return data
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class SpooledSubmissionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.spool = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spool.cleanup)
+        override = override_settings(QUIZ_SUBMISSION_SPOOL_DIR=self.spool.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        # Spool every submission, and drain in the test thread rather than in the
+        # background drainer, which could not see the test transaction.
+        for patcher in (mock.patch.object(admission, 'try_admit', return_value=False),
+                        mock.patch.object(admission, '_ensure_drainer')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user('student', password='password')
+        self.client.force_login(self.user)
+        self.quiz = create_quiz()
+        self.earlier = create_submission(self.quiz, self.user, status=QuizSubmission.SubmissionStatus.COMPLETED)
+        self.client.get(reverse('quiz:take_quiz', args=[self.quiz.pk]))
+        self.attempt = QuizSubmission.objects.get(user=self.user, status=QuizSubmission.SubmissionStatus.IN_PROGRESS)
+
+    def submit(self):
+        response = self.client.post(reverse('quiz:take_quiz', args=[self.quiz.pk]), answer_form(self.quiz, self.attempt))
+        pending_url = f"{reverse('quiz:submission_pending', args=[self.quiz.pk])}?token={self.attempt.submit_token.hex}"
+        self.assertRedirects(response, pending_url, fetch_redirect_response=False)
+        return pending_url
+
+    def test_pending_page_follows_the_spooled_attempt(self):
+        pending_url = self.submit()
+        self.assertContains(self.client.get(pending_url), 'are being saved')
+
+        self.assertEqual(admission.drain(process_spooled_submission), 1)
+        result_url = reverse('quiz:submission_result', args=[self.attempt.pk])
+        self.assertRedirects(self.client.get(pending_url), result_url, fetch_redirect_response=False)
+        # Without the cached outcome (e.g. another host's cache) the attempt is found by its token.
+        cache.clear()
+        self.assertRedirects(self.client.get(pending_url), result_url, fetch_redirect_response=False)
+
+    def test_replay_while_spooled_is_not_spooled_again(self):
+        pending_url = self.submit()
+        self.submit()
+        self.assertEqual(admission.spool_depth(), 1)
+
+        admission.drain(process_spooled_submission)
+        response = self.client.post(reverse('quiz:take_quiz', args=[self.quiz.pk]), answer_form(self.quiz, self.attempt))
+        self.assertRedirects(response, reverse('quiz:submission_result', args=[self.attempt.pk]), fetch_redirect_response=False)
+        self.assertEqual(admission.spool_depth(), 0)
+        self.assertEqual(self.attempt.answers.count(), self.quiz.questions.count())
+
+    def test_drain_after_sweep_records_on_time_answers(self):
+        self.submit()
+        # The sweeper runs before the drainer, once the grace period has passed.
+        sweep_time = self.attempt.deadline + settings.QUIZ_DEADLINE_GRACE_PERIOD + timedelta(seconds=1)
+        with mock.patch('django.utils.timezone.now', return_value=sweep_time):
+            call_command('expire_submissions', '--once', stdout=StringIO())
+        self.attempt.refresh_from_db()
+        self.assertNotEqual(self.attempt.status, QuizSubmission.SubmissionStatus.IN_PROGRESS)
+        self.assertEqual(self.attempt.score, 0)
+
+        self.assertEqual(admission.drain(process_spooled_submission), 1)
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.answers.count(), self.quiz.questions.count())
+        self.assertGreater(self.attempt.score, 0)
+        # Draining a replay of the same form does not save the answers twice.
+        cache.clear()
+        self.submit()
+        self.assertEqual(admission.drain(process_spooled_submission), 1)
+        self.assertEqual(self.attempt.answers.count(), self.quiz.questions.count())
+
+    def test_failed_drain_is_reported_on_the_pending_page(self):
+        pending_url = self.submit()
+        # The attempt disappears before it is drained, so no attempt matches the form.
+        self.attempt.delete()
+        with self.assertLogs('quiz.admission', 'ERROR'):
+            admission.drain(process_spooled_submission)
+        self.assertEqual(len(list((Path(self.spool.name) / 'failed').glob('*.json*'))), 1)
+
+        response = self.client.get(pending_url)
+        self.assertContains(response, 'could not be saved')
+        self.assertNotContains(response, 'are being saved')
+
+
+SOLUTION = '''def solve(numbers):
+    total = 0
+    for number in numbers:
+        if number % 2 == 0:
+            total += number * number
+    return total
+'''
+
+# SOLUTION with other names, which normalization must see through.
+RENAMED_SOLUTION = SOLUTION.replace('numbers', 'values').replace('number', 'value').replace('total', 'result')
+
+OTHER_SOLUTION = '''def solve(numbers):
+    seen = {}
+    while numbers:
+        item = numbers.pop()
+        seen[item] = seen.get(item, 0) + 1
+    return max(seen, key=seen.get) if seen else None
+'''
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class CodeSimilarityTests(TestCase):
+    def setUp(self):
+        self.quiz = create_quiz(mcq=0, msq=0, code=1)
+        self.question = self.quiz.questions.get()
+
+    def create_answers(self, codes):
+        users = User.objects.bulk_create([User(username=f'student-{uuid.uuid4().hex[:12]}') for _ in codes])
+        submissions = QuizSubmission.objects.bulk_create([
+            QuizSubmission(user=user, quiz=self.quiz, status=QuizSubmission.SubmissionStatus.SUBMITTED) for user in users
+        ])
+        return UserAnswer.objects.bulk_create([
+            UserAnswer(submission=submission, question=self.question, code_answer=code)
+            for submission, code in zip(submissions, codes)
+        ])
+
+    def test_clusters_near_duplicates_only(self):
+        original, renamed, other = self.create_answers([SOLUTION, RENAMED_SOLUTION, OTHER_SOLUTION])
+        self.assertEqual(index_pending(), (3, 1))
+
+        (cluster_id, answer_ids, _), = similar_clusters(self.question)
+        self.assertEqual(set(answer_ids), {original.pk, renamed.pk})
+        self.assertIn(cluster_id, answer_ids)
+        self.assertEqual(CodeSignature.objects.get(pk=other.pk).cluster_id, other.pk)
+        # Later batches join the existing cluster.
+        late, = self.create_answers([SOLUTION])
+        self.assertEqual(index_pending(), (1, 1))
+        self.assertEqual(CodeSignature.objects.get(pk=late.pk).cluster_id, cluster_id)
+
+    def test_empty_answers_are_not_compared(self):
+        # Comments are not compared, so an answer with only a comment is empty too.
+        self.create_answers(['', '', '   \n', '# TODO\n'])
+        self.assertEqual(index_pending(), (4, 0))
+        self.assertEqual(similar_clusters(self.question), [])
+        self.assertFalse(CodeSignatureBand.objects.exists())
+
+    def test_identical_answers_are_indexed_in_linear_space(self):
+        self.create_answers([SOLUTION] * 600)
+        with mock.patch('quiz.similarity.estimated_similarity', wraps=estimated_similarity) as compare:
+            self.assertEqual(index_pending(batch_size=200), (600, 599))
+        # Each answer is compared with the single representative only.
+        self.assertEqual(compare.call_count, 599)
+
+        (cluster_id, answer_ids, similarity), = similar_clusters(self.question)
+        self.assertEqual((len(answer_ids), similarity), (600, 1.0))
+        # Only the representative is banded.
+        self.assertEqual(CodeSignatureBand.objects.count(), LSH_BANDS)
+
+    def test_admin_pages_do_not_index(self):
+        self.create_answers([SOLUTION, SOLUTION])
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        for name in ('admin:quiz_question_similarity', 'admin:quiz_question_grade'):
+            response = self.client.get(reverse(name, args=[self.question.pk]))
+            self.assertContains(response, '2 answers not indexed yet')
+        self.assertFalse(CodeSignature.objects.exists())
+
+        index_pending()
+        response = self.client.get(reverse('admin:quiz_question_grade', args=[self.question.pk]))
+        self.assertContains(response, 'In a cluster of 2 similar answers')
+        response = self.client.get(reverse('admin:quiz_question_similarity', args=[self.question.pk]))
+        self.assertContains(response, '2 answers, at least 100% similar')
+
+
+class BenchmarkComparisonTests(SimpleTestCase):
+    def test_find_regressions(self):
+        baseline = {
+            'grade_mcq_msq[10]': {'min_ms': 10.0, 'peak_alloc_kib': 100.0, 'queries': 4},
+            'load_quizzes[10]': {'min_ms': 10.0, 'peak_alloc_kib': 100.0, 'queries': 40},
+        }
+        results = {
+            # Within the threshold, apart from one more query.
+            'grade_mcq_msq[10]': {'min_ms': 11.0, 'peak_alloc_kib': 100.0, 'queries': 5},
+            'load_quizzes[10]': {'min_ms': 13.0, 'peak_alloc_kib': 90.0, 'queries': 40},
+            # Not in the baseline.
+            'grade_mcq_msq[50]': {'min_ms': 99.0, 'peak_alloc_kib': 999.0, 'queries': 9},
+        }
+        self.assertEqual(find_regressions(results, baseline, threshold=0.2), [
+            'grade_mcq_msq[10]: queries 5 > baseline 4',
+            'load_quizzes[10]: min_ms 13.0 > baseline 10.0 (+30%)',
+        ])
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class BenchmarkCommandTests(TransactionTestCase):
+    # Queries are counted on every connection.
+    databases = {'default', REPLICA_ALIAS}
+
+    def setUp(self):
+        # The command's own test databases would replace the ones this test runs in.
+        for name in ('setup_databases', 'teardown_databases'):
+            patcher = mock.patch(f'quiz.management.commands.run_benchmarks.{name}')
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.baseline = Path(directory.name) / 'baseline.json'
+
+    def run_benchmarks(self, *args):
+        out = StringIO()
+        call_command('run_benchmarks', '--sizes', '2', '--repeat', '1', '--baseline', str(self.baseline), *args, stdout=out)
+        return out.getvalue()
+
+    def test_save_and_compare_baseline(self):
+        self.assertIn('No baseline at', self.run_benchmarks())
+        self.assertIn('Saved baseline', self.run_benchmarks('--save-baseline'))
+        results = json.loads(self.baseline.read_text())['results']
+        self.assertEqual(set(results), {f'{name}[2]' for name in BENCHMARKS})
+
+        self.assertIn('No regressions against the baseline.', self.run_benchmarks('--threshold', '1000'))
+        results['grade_mcq_msq[2]']['queries'] -= 1
+        self.baseline.write_text(json.dumps({'results': results}))
+        with self.assertRaisesMessage(CommandError, 'grade_mcq_msq[2]: queries'):
+            self.run_benchmarks('--threshold', '1000')
+
+
+class RegradeTests(TestCase):
+    """
+    regrade_questions scores answer rows in SQL (_correct_choice_answer_condition)
+    and packed answers in Python; both must agree with score_choice_answer.
+    """
+    # Selections per question, by choice number. Choice ids are UUID(int=number), so
+    # their order (which decides MCQs with several selected choices) is known.
+    MCQ_SELECTIONS = [{2}, {1}, {3}, {1, 2}, {2, 3}, set()]
+    MSQ_SELECTIONS = [{11, 12}, {11}, {11, 13}, {11, 12, 13}, {12, 13}, set()]
+
+    def setUp(self):
+        self.user = User.objects.create_user('student', password='password')
+        self.quiz = Quiz.objects.create(title='Quiz', duration=timedelta(minutes=30))
+        self.mcq = Question.objects.create(quiz=self.quiz, question_text='MCQ', question_type=Question.QuestionType.MCQ, points=2.0, order=0)
+        self.msq = Question.objects.create(quiz=self.quiz, question_text='MSQ', question_type=Question.QuestionType.MSQ, points=3.0, order=1)
+        for question, numbers, correct in ((self.mcq, range(1, 5), {2}), (self.msq, range(11, 15), {11, 12})):
+            for number in numbers:
+                Choice.objects.create(id=uuid.UUID(int=number), question=question, choice_text=str(number), is_correct=number in correct)
+
+        # Every combination of selections, once as answer rows and once packed.
+        self.selections = {}
+        for mcq_selected in self.MCQ_SELECTIONS:
+            for msq_selected in self.MSQ_SELECTIONS:
+                selected = {self.mcq.id: self.choice_ids(mcq_selected), self.msq.id: self.choice_ids(msq_selected)}
+                submission = QuizSubmission.objects.create(user=self.user, quiz=self.quiz)
+                for question in (self.mcq, self.msq):
+                    answer = UserAnswer.objects.create(submission=submission, question=question)
+                    answer.selected_choices.set(selected[question.id])
+                self.selections[submission.pk] = selected
+                packed = QuizSubmission.objects.create(
+                    user=self.user, quiz=self.quiz, choice_answers=pack_choice_answers(selected),
+                )
+                self.selections[packed.pk] = selected
+        grade_submissions(QuizSubmission.objects.all())
+        # Answers never auto-graded (e.g. saved before grading existed) have no points.
+        UserAnswer.objects.filter(selected_choices__isnull=True).update(points_awarded=None)
+
+    @staticmethod
+    def choice_ids(numbers):
+        return {uuid.UUID(int=number) for number in numbers}
+
+    def set_correct(self, question, numbers):
+        for choice in question.choices.all():
+            choice.is_correct = choice.pk in self.choice_ids(numbers)
+            choice.save()
+
+    def expected_points(self, question, selected):
+        correct = set(question.choices.filter(is_correct=True).values_list('pk', flat=True))
+        return score_choice_answer(question.question_type, question.points, correct, selected)
+
+    def assert_scores_match_choices(self, regraded):
+        for submission in QuizSubmission.objects.all():
+            selected = self.selections[submission.pk]
+            expected = {question.id: self.expected_points(question, selected[question.id]) for question in (self.mcq, self.msq)}
+            if submission.choice_answers is None:
+                points = dict(submission.answers.values_list('question_id', 'points_awarded'))
+                # Answers to the other questions keep their points, even when NULL.
+                for question in {self.mcq, self.msq} - set(regraded):
+                    points[question.id] = points[question.id] or 0
+                self.assertEqual(points, expected, selected)
+            else:
+                self.assertEqual(submission.choice_points, sum(expected.values()), selected)
+            self.assertEqual(submission.score, sum(expected.values()), selected)
+
+    def test_mcq_flip(self):
+        self.set_correct(self.mcq, {1})
+        changed_count, rescored_count = regrade_questions([self.mcq])
+        self.assertGreater(changed_count, 0)
+        self.assertEqual(rescored_count, QuizSubmission.objects.count())
+        self.assert_scores_match_choices([self.mcq])
+
+    def test_mcq_with_several_correct_choices(self):
+        # Only the earliest correct choice counts for an MCQ.
+        self.set_correct(self.mcq, {2, 3})
+        regrade_questions([self.mcq])
+        self.assert_scores_match_choices([self.mcq])
+
+    def test_msq_flip_in_batches_of_one(self):
+        self.set_correct(self.msq, {11, 13})
+        regrade_questions([self.msq], batch_size=1)
+        self.assert_scores_match_choices([self.msq])
+
+    def test_no_correct_choices(self):
+        self.set_correct(self.mcq, set())
+        self.set_correct(self.msq, set())
+        regrade_questions([self.mcq, self.msq], batch_size=7)
+        self.assert_scores_match_choices([self.mcq, self.msq])
+
+    def test_regrade_without_changes_writes_only_missing_points(self):
+        regrade_questions([self.mcq, self.msq])
+        self.assert_scores_match_choices([self.mcq, self.msq])
+        self.assertEqual(regrade_questions([self.mcq, self.msq]), (0, 0))
+
+    def test_in_progress_submissions_are_skipped(self):
+        submission = QuizSubmission.objects.filter(choice_answers__isnull=True).first()
+        QuizSubmission.objects.filter(pk=submission.pk).update(status=QuizSubmission.SubmissionStatus.IN_PROGRESS, score=None)
+        self.set_correct(self.mcq, {1})
+        regrade_questions([self.mcq])
+        submission.refresh_from_db()
+        self.assertIsNone(submission.score)
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class SubmitTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('student', password='password')
+        self.client.force_login(self.user)
+        self.quiz = create_quiz()
+        self.client.get(reverse('quiz:take_quiz', args=[self.quiz.pk]))
+        self.attempt = QuizSubmission.objects.get(user=self.user)
+        self.form = answer_form(self.quiz, self.attempt)
+
+    def post(self, quiz=None):
+        return self.client.post(reverse('quiz:take_quiz', args=[(quiz or self.quiz).pk]), self.form)
+
+    def assert_redirects_to_result(self, response):
+        self.assertRedirects(response, reverse('quiz:submission_result', args=[self.attempt.pk]), fetch_redirect_response=False)
+
+    def test_replay_is_answered_from_the_cache_without_writes(self):
+        self.assert_redirects_to_result(self.post())
+        with CaptureQueriesContext(connection) as queries:
+            self.assert_redirects_to_result(self.post())
+        writes = [query['sql'] for query in queries.captured_queries if not query['sql'].startswith('SELECT')]
+        self.assertEqual(writes, [])
+
+    def test_replay_after_cache_miss_returns_the_same_submission(self):
+        self.assert_redirects_to_result(self.post())
+        self.attempt.refresh_from_db()
+        answer_count = UserAnswer.objects.count()
+        cache.clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assert_redirects_to_result(self.post())
+        # Neither the submission nor the session (pinned by the first post) is written.
+        writes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(writes, [])
+        self.assertEqual(UserAnswer.objects.count(), answer_count)
+        self.assertEqual(QuizSubmission.objects.count(), 1)
+        submission = QuizSubmission.objects.get()
+        self.assertEqual((submission.score, submission.end_time), (self.attempt.score, self.attempt.end_time))
+
+    def test_token_is_scoped_to_user_and_quiz(self):
+        self.assert_redirects_to_result(self.post())
+
+        other_quiz = create_quiz('Other')
+        response = self.post(quiz=other_quiz)
+        self.assertRedirects(response, reverse('quiz:quiz_detail', args=[other_quiz.pk]), fetch_redirect_response=False)
+
+        self.client.force_login(User.objects.create_user('other', password='password'))
+        response = self.post()
+        self.assertRedirects(response, reverse('quiz:quiz_detail', args=[self.quiz.pk]), fetch_redirect_response=False)
+        self.assertEqual(UserAnswer.objects.filter(submission__user__username='other').count(), 0)
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class SubmissionChangePageTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+
+    def change_page_submission(self, answer_count):
+        # A third of the answers are coding answers, the rest choice answers.
+        quiz = create_quiz(title=f'Quiz {answer_count}', mcq=answer_count // 3, msq=answer_count // 3, code=answer_count // 3)
+        submission = create_submission(quiz, self.admin, status=QuizSubmission.SubmissionStatus.SUBMITTED)
+        self.assertEqual(submission.answers.count(), answer_count)
+        return reverse('admin:quiz_quizsubmission_change', args=[submission.pk])
+
+    def test_change_page_query_count_does_not_grow_with_answers(self):
+        small_url, large_url = self.change_page_submission(3), self.change_page_submission(30)
+        # The first admin request fills per-process caches (e.g. content types).
+        self.client.get(small_url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(small_url).status_code, 200)
+        with self.assertNumQueries(len(queries.captured_queries)):
+            response = self.client.get(large_url)
+        self.assertContains(response, 'print(&quot;hello&quot;)', count=10)
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+@mock.patch('quiz.admin.GRADING_PAGE_SIZE', 2)
+class GradeAnswersViewTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+        self.quiz = create_quiz(mcq=1, msq=0, code=1)
+        self.question = self.quiz.questions.get(question_type=Question.QuestionType.CODING)
+        self.submissions = []
+        for number in range(5):
+            submission = create_submission(self.quiz, User.objects.create_user(f'student-{number}'), code=f'print({number})')
+            submission.grade_mcq_msq()
+            self.submissions.append(submission)
+        self.answer_ids = sorted(UserAnswer.objects.filter(question=self.question).values_list('pk', flat=True))
+        self.url = reverse('admin:quiz_question_grade', args=[self.question.pk])
+
+    def page_answer_ids(self, response):
+        return [form.instance.pk for form in response.context['forms']]
+
+    def grade_data(self, grades, finalize=False):
+        data = {'answer_ids': [str(answer_id) for answer_id in grades]}
+        for answer_id, points in grades.items():
+            data[f'{answer_id}-points_awarded'] = points
+            data[f'{answer_id}-feedback'] = ''
+        data['_finalize' if finalize else '_save'] = '1'
+        return data
+
+    def test_keyset_pagination(self):
+        first = self.client.get(self.url)
+        self.assertEqual(self.page_answer_ids(first), self.answer_ids[:2])
+        self.assertEqual((first.context['previous_cursor'], first.context['next_cursor']), (None, self.answer_ids[1]))
+
+        second = self.client.get(self.url, {'after': self.answer_ids[1]})
+        self.assertEqual(self.page_answer_ids(second), self.answer_ids[2:4])
+        last = self.client.get(self.url, {'after': self.answer_ids[3]})
+        self.assertEqual(self.page_answer_ids(last), self.answer_ids[4:])
+        self.assertIsNone(last.context['next_cursor'])
+
+        back = self.client.get(self.url, {'before': self.answer_ids[2]})
+        self.assertEqual(self.page_answer_ids(back), self.answer_ids[:2])
+        self.assertIsNone(back.context['previous_cursor'])
+
+        UserAnswer.objects.filter(pk__in=self.answer_ids[:3]).update(points_awarded=1)
+        ungraded = self.client.get(self.url, {'ungraded': '1'})
+        self.assertEqual(self.page_answer_ids(ungraded), self.answer_ids[3:])
+
+    def test_save_and_finalize(self):
+        response = self.client.post(self.url, self.grade_data({self.answer_ids[0]: 1.5, self.answer_ids[1]: 2}))
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        self.assertEqual(
+            list(UserAnswer.objects.filter(pk__in=self.answer_ids[:2]).order_by('pk').values_list('points_awarded', flat=True)),
+            [1.5, 2.0],
+        )
+        self.assertFalse(QuizSubmission.objects.filter(status=QuizSubmission.SubmissionStatus.COMPLETED).exists())
+
+        self.client.post(self.url, self.grade_data({self.answer_ids[2]: 0}, finalize=True))
+        completed = QuizSubmission.objects.filter(status=QuizSubmission.SubmissionStatus.COMPLETED)
+        self.assertEqual(completed.count(), 3)
+        answer = UserAnswer.objects.get(pk=self.answer_ids[0])
+        self.assertEqual(answer.submission.score, 2.0 + 1.5)
+
+        # Regrading an answer of a completed submission rescores it.
+        self.client.post(self.url, self.grade_data({self.answer_ids[0]: 0.5}))
+        answer.submission.refresh_from_db()
+        self.assertEqual(answer.submission.score, 2.0 + 0.5)
+
+    def test_invalid_post_keeps_navigation_and_clusters(self):
+        index_pending()
+        response = self.client.post(
+            f'{self.url}?after={self.answer_ids[1]}',
+            self.grade_data({self.answer_ids[2]: 5, self.answer_ids[3]: 1}),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Points must be between 0 and 2.0.')
+        self.assertEqual((response.context['previous_cursor'], response.context['next_cursor']), (self.answer_ids[2], self.answer_ids[3]))
+        self.assertTrue(all(hasattr(form.instance, 'cluster_size') for form in response.context['forms']))
+        self.assertFalse(UserAnswer.objects.filter(pk__in=self.answer_ids, points_awarded__isnull=False).exists())
+
+
+@override_settings(STORAGES=TEST_STORAGES, QUIZ_DEADLINE_GRACE_PERIOD=timedelta(seconds=30))
+class DeadlineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('student', password='password')
+        self.client.force_login(self.user)
+        self.quiz = create_quiz()
+        self.url = reverse('quiz:take_quiz', args=[self.quiz.pk])
+
+    def start_attempt(self, overdue_by=None):
+        response = self.client.get(self.url)
+        attempt = QuizSubmission.objects.get(submit_token=response.context['submit_token'])
+        if overdue_by is not None:
+            attempt.deadline = timezone.now() - overdue_by
+            attempt.save(update_fields=['deadline'])
+        return attempt
+
+    def test_get_resumes_the_running_attempt(self):
+        attempt = self.start_attempt()
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['submit_token'], attempt.submit_token)
+        self.assertEqual(QuizSubmission.objects.filter(user=self.user).count(), 1)
+
+        # An attempt whose deadline has passed is not resumed.
+        attempt.deadline = timezone.now() - timedelta(seconds=1)
+        attempt.save(update_fields=['deadline'])
+        response = self.client.get(self.url)
+        self.assertNotEqual(response.context['submit_token'], attempt.submit_token)
+        self.assertEqual(QuizSubmission.objects.filter(user=self.user).count(), 2)
+
+    def test_post_within_grace_period_is_saved(self):
+        attempt = self.start_attempt(overdue_by=timedelta(seconds=10))
+        response = self.client.post(self.url, answer_form(self.quiz, attempt))
+        self.assertRedirects(response, reverse('quiz:submission_result', args=[attempt.pk]), fetch_redirect_response=False)
+        self.assertEqual(attempt.answers.count(), self.quiz.questions.count())
+
+    def test_late_post_closes_attempt_without_answers(self):
+        attempt = self.start_attempt(overdue_by=timedelta(minutes=5))
+        response = self.client.post(self.url, answer_form(self.quiz, attempt))
+        self.assertRedirects(response, reverse('quiz:submission_result', args=[attempt.pk]), fetch_redirect_response=False)
+        attempt.refresh_from_db()
+        self.assertNotEqual(attempt.status, QuizSubmission.SubmissionStatus.IN_PROGRESS)
+        self.assertFalse(attempt.answers.exists())
+        self.assertEqual(attempt.score, 0)
+
+    def test_sweeper_closes_only_attempts_past_the_grace_period(self):
+        running = QuizSubmission.objects.create(user=self.user, quiz=self.quiz)
+        in_grace = create_submission(self.quiz, User.objects.create_user('in-grace'))
+        overdue = create_submission(self.quiz, User.objects.create_user('overdue'))
+        QuizSubmission.objects.filter(pk=in_grace.pk).update(deadline=timezone.now() - timedelta(seconds=10))
+        QuizSubmission.objects.filter(pk=overdue.pk).update(deadline=timezone.now() - timedelta(minutes=5))
+
+        out = StringIO()
+        call_command('expire_submissions', '--once', stdout=out)
+        self.assertIn('Expired 1 submission(s).', out.getvalue())
+
+        statuses = dict(QuizSubmission.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[running.pk], QuizSubmission.SubmissionStatus.IN_PROGRESS)
+        self.assertEqual(statuses[in_grace.pk], QuizSubmission.SubmissionStatus.IN_PROGRESS)
+        self.assertEqual(statuses[overdue.pk], QuizSubmission.SubmissionStatus.SUBMITTED)
+        # The overdue attempt is graded with the answers it had recorded.
+        overdue.refresh_from_db()
+        self.assertGreater(overdue.score, 0)
@@ -13,6 +13,12 @@ urlpatterns = [
     # Example: /quizzes/a1b2c3d4-e5f6-7890-1234-567890abcdef/take/
     path('<uuid:quiz_id>/take/', views.take_quiz, name='take_quiz'),
 
+    # Example: /quizzes/a1b2c3d4-e5f6-7890-1234-567890abcdef/pending/
+    path('<uuid:quiz_id>/pending/', views.submission_pending, name='submission_pending'),
+
+    # Example: /quizzes/api/v1/a1b2c3d4-e5f6-7890-1234-567890abcdef/paper/
+    path('api/v1/<uuid:quiz_id>/paper/', views.quiz_paper_api, name='quiz_paper_api'),
+
     # Example: /quizzes/submission/a1b2c3d4-e5f6-7890-1234-567890abcdef/result/
     path('submission/<uuid:submission_id>/result/', views.submission_result, name='submission_result'),
     
@@ -22,5 +28,16 @@ urlpatterns = [
 
     # Example: /quizzes/my-history/submission/a1b2c3d4-e5f6-7890-1234-567890abcdef/
     path('my-history/submission/<uuid:submission_id>/', views.submission_detail, name='submission_detail'),
+
+    # Staff-only admission-control metrics
+    # Example: /quizzes/metrics/submissions/
+    path('metrics/submissions/', views.submission_metrics, name='submission_metrics'),
+
+    # Staff-only request profiles
+    # Example: /quizzes/profiles/
+    path('profiles/', views.profile_list, name='profile_list'),
+
+    # Example: /quizzes/profiles/quiz.submission_detail/20251019T101500000000-1a2b3c4d.folded
+    path('profiles/<str:view_directory>/<str:filename>', views.profile_file, name='profile_file'),
 ]
 
@@ -1,8 +1,26 @@
+import gzip
+import heapq
+import json
+import uuid
+from operator import attrgetter
 from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import reverse
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
-from django.db.models import Sum
-from .models import Quiz, Question, Choice, QuizSubmission, UserAnswer
+from django.db import transaction
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, Sum
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+from core.db_router import pin_to_primary, read_from_replica
+from . import admission
+from .profiling import profiles_root
+from .models import Quiz, Question, Choice, QuizSubmission, UserAnswer, ArchivedSubmission, pack_choice_answers, unpack_choice_answers
 
 @login_required
 def quiz_list(request):
@@ -21,49 +39,386 @@ def quiz_detail(request, quiz_id):
     # If it's a regular GET request, it just displays the quiz details as before.
     return render(request, 'quiz/quiz_detail.html', {'quiz': quiz})
 
+# Cached outcomes of a submit token whose submission is waiting in the spool, or
+# could not be persisted from it. Otherwise the outcome is the submission id.
+SUBMIT_TOKEN_PENDING = 'pending'
+SUBMIT_TOKEN_FAILED = 'failed'
+
 @login_required
 def take_quiz(request, quiz_id):
+    if request.method == 'POST':
+        # A replayed form (double click, retry, auto-submit racing a manual submit)
+        # is answered from the cache, without touching the database.
+        submit_token = _parse_submit_token(request.POST.get('submit_token'))
+        if submit_token is not None:
+            outcome = cache.get(_submit_token_cache_key(request.user.pk, quiz_id, submit_token))
+            if outcome == SUBMIT_TOKEN_PENDING:
+                return _redirect_to_pending(quiz_id, submit_token)
+            # A form whose spooled copy failed is processed again below.
+            if outcome not in (None, SUBMIT_TOKEN_FAILED):
+                return redirect('quiz:submission_result', submission_id=outcome)
+
+        # Admission control runs before any quiz query: when all of this worker's
+        # submission slots are busy, the answers are spooled and persisted later.
+        received_at = timezone.now()
+        if not admission.try_admit():
+            if submit_token is not None:
+                # Set before spooling, so the drainer's outcome cannot be overwritten.
+                cache.set(
+                    _submit_token_cache_key(request.user.pk, quiz_id, submit_token),
+                    SUBMIT_TOKEN_PENDING,
+                    settings.QUIZ_SUBMIT_TOKEN_CACHE_TIMEOUT,
+                )
+            admission.spool_submission(request.user.pk, quiz_id, request.POST, received_at, process_spooled_submission)
+            pin_to_primary(request)
+            return _redirect_to_pending(quiz_id, submit_token)
+        try:
+            get_object_or_404(Quiz, pk=quiz_id)
+            submission, submitted = process_submission(request.user.pk, quiz_id, request.POST, received_at)
+        finally:
+            admission.release_slot()
+        if submission is None:
+            return redirect('quiz:quiz_detail', quiz_id=quiz_id)
+
+        # The history and review pages read from the replica; keep this user on the
+        # primary until their new submission has replicated. A replay changed nothing,
+        # so it does not write the session either.
+        if submitted:
+            pin_to_primary(request)
+        return redirect('quiz:submission_result', submission_id=submission.id)
+
     quiz = get_object_or_404(Quiz, pk=quiz_id)
     questions = quiz.questions.all()
 
-    if request.method == 'POST':
-        submission = QuizSubmission.objects.create(
-            user=request.user,
-            quiz=quiz
+    # Resume the running attempt, or start a new one. The deadline is fixed on the
+    # server when the attempt starts, so reloading the page does not reset the timer.
+    now = timezone.now()
+    submission = (
+        QuizSubmission.objects
+        .filter(user=request.user, quiz=quiz, status=QuizSubmission.SubmissionStatus.IN_PROGRESS, deadline__gt=now)
+        .order_by('-start_time')
+        .first()
+    )
+    if submission is None:
+        submission = QuizSubmission.objects.create(user=request.user, quiz=quiz)
+
+    # The time_left_seconds context variable is needed for the timer in your template
+    time_left_seconds = max(int((submission.deadline - now).total_seconds()), 0)
+    return render(request, 'quiz/take_quiz.html', {
+        'quiz': quiz,
+        'questions': questions,
+        'time_left_seconds': time_left_seconds,
+        'submit_token': submission.submit_token,
+    })
+
+def _parse_submit_token(value):
+    try:
+        return uuid.UUID(value) if value else None
+    except ValueError:
+        return None
+
+def _submit_token_cache_key(user_id, quiz_id, submit_token):
+    # Scoped to the user and the quiz, like the attempt lookup in process_submission,
+    # so a token posted by someone else or to another quiz resolves to nothing.
+    return f"quiz:submit-token:{user_id}:{quiz_id.hex}:{submit_token.hex}"
+
+def process_submission(user_id, quiz_id, data, received_at):
+    """
+    Saves and grades the posted answers of the user's running attempt at a quiz.
+    Used for admitted requests and for submissions drained from the spool, so the
+    deadline is checked against the time the answers were received.
+
+    The form's submit token identifies the attempt. When that attempt has already
+    been submitted (a replayed form), it is returned unchanged, without any writes,
+    unless the expiry sweeper closed it before these on-time answers were persisted.
+    Forms without a token fall back to the user's latest running attempt.
+    Returns a (submission, submitted) tuple, where `submitted` is False when the
+    submission was left unchanged; the submission is None if no attempt matches.
+    """
+    submit_token = _parse_submit_token(data.get('submit_token'))
+    with transaction.atomic():
+        # The attempt was started by the take_quiz GET; lock it so the expiry
+        # sweeper, or a concurrent replay of the same form, waits until the
+        # answers have been written.
+        attempts = (
+            QuizSubmission.objects.select_for_update()
+            .select_related('quiz')
+            .filter(user_id=user_id, quiz_id=quiz_id)
         )
+        if submit_token is not None:
+            submission = attempts.filter(submit_token=submit_token).first()
+        else:
+            submission = (
+                attempts.filter(status=QuizSubmission.SubmissionStatus.IN_PROGRESS)
+                .order_by('-start_time')
+                .first()
+            )
+        if submission is None:
+            return None, False
 
-        for question in questions:
-            user_answer = UserAnswer(question=question, submission=submission)
-            
-            if question.question_type == 'MCQ':
-                choice_id = request.POST.get(f'question_{question.id}')
-                if choice_id:
-                    selected_choice = get_object_or_404(Choice, pk=choice_id)
-                    user_answer.save() 
-                    user_answer.selected_choices.add(selected_choice)
-            
-            elif question.question_type == 'MSQ':
-                choice_ids = request.POST.getlist(f'question_{question.id}')
-                user_answer.save()
-                if choice_ids:
-                    for choice_id in choice_ids:
-                        selected_choice = get_object_or_404(Choice, pk=choice_id)
-                        user_answer.selected_choices.add(selected_choice)
-
-            elif question.question_type == 'CODE':
-                code = request.POST.get(f'question_{question.id}')
-                user_answer.code_answer = code
-                user_answer.save()
+        submitted = True
+        if submission.status == QuizSubmission.SubmissionStatus.IN_PROGRESS:
+            # Answers received after the deadline (plus grace period) are discarded;
+            # the attempt is closed with whatever had been recorded before.
+            if not submission.is_past_deadline(received_at):
+                save_answers(submission, submission.quiz.questions.all(), data)
+            submission.grade_mcq_msq()
+        elif not submission.is_past_deadline(received_at) and not _has_saved_answers(submission):
+            # The sweeper expired the attempt while its answers waited in the spool
+            # (or for the row lock); they were received in time, so record and regrade.
+            save_answers(submission, submission.quiz.questions.all(), data)
+            submission.grade_mcq_msq()
+        else:
+            submitted = False
+
+    if submit_token is not None:
+        cache.set(_submit_token_cache_key(user_id, quiz_id, submit_token), submission.id, settings.QUIZ_SUBMIT_TOKEN_CACHE_TIMEOUT)
+    return submission, submitted
+
+def _has_saved_answers(submission):
+    # Answers are only written on submit, so an attempt without any was closed unanswered.
+    return submission.choice_answers is not None or submission.answers.exists()
+
+def process_spooled_submission(user_id, quiz_id, data, received_at):
+    """
+    Spool handler persisting a drained submission with process_submission. When it
+    fails, or no attempt matches the form, the failure is recorded under the form's
+    submit token for the pending page and the error is raised, so the spool entry is
+    moved aside.
+    """
+    try:
+        submission, _ = process_submission(user_id, quiz_id, data, received_at)
+        if submission is None:
+            raise LookupError(f"No attempt of quiz {quiz_id} by user {user_id} matches the spooled submission.")
+    except Exception:
+        submit_token = _parse_submit_token(data.get('submit_token'))
+        if submit_token is not None:
+            cache.set(_submit_token_cache_key(user_id, quiz_id, submit_token), SUBMIT_TOKEN_FAILED, settings.QUIZ_SUBMIT_TOKEN_CACHE_TIMEOUT)
+        raise
+    return submission
+
+def save_answers(submission, questions, data):
+    """
+    Creates the UserAnswer rows of a submission from the posted quiz form.
+    """
+    if settings.QUIZ_PACKED_CHOICE_ANSWERS:
+        save_packed_answers(submission, questions, data)
+        return
+
+    for question in questions:
+        user_answer = UserAnswer(question=question, submission=submission)
         
-        # NOTE: You have a call to a method here that is not defined in your models.
-        # You will need to implement the grade_mcq_msq() method in your QuizSubmission model.
-        # submission.grade_mcq_msq() 
+        if question.question_type == 'MCQ':
+            choice_id = data.get(f'question_{question.id}')
+            if choice_id:
+                selected_choice = get_object_or_404(Choice, pk=choice_id)
+                user_answer.save() 
+                user_answer.selected_choices.add(selected_choice)
         
+        elif question.question_type == 'MSQ':
+            choice_ids = data.getlist(f'question_{question.id}')
+            user_answer.save()
+            if choice_ids:
+                for choice_id in choice_ids:
+                    selected_choice = get_object_or_404(Choice, pk=choice_id)
+                    user_answer.selected_choices.add(selected_choice)
+
+        elif question.question_type == 'CODE':
+            code = data.get(f'question_{question.id}')
+            user_answer.code_answer = code
+            user_answer.save()
+
+def save_packed_answers(submission, questions, data):
+    """
+    Stores the MCQ/MSQ answers of the posted quiz form as one packed record on the
+    submission, and creates UserAnswer rows for coding answers only.
+    """
+    choice_ids = {}
+    for question_id, choice_id in Choice.objects.filter(question__quiz_id=submission.quiz_id).values_list('question_id', 'id'):
+        choice_ids.setdefault(question_id, []).append(choice_id)
+
+    selected_choices = {}
+    code_answers = []
+    for question in questions:
+        if question.question_type == 'CODE':
+            code = data.get(f'question_{question.id}')
+            code_answers.append(UserAnswer(question=question, submission=submission, code_answer=code or ''))
+            continue
+        # Posted values that are not choices of this question are ignored.
+        valid_ids = {str(choice_id): choice_id for choice_id in choice_ids.get(question.id, ())}
+        posted_ids = data.getlist(f'question_{question.id}')
+        if question.question_type == 'MCQ':
+            posted_ids = posted_ids[:1]
+        selected_choices[question.id] = {valid_ids[value] for value in posted_ids if value in valid_ids}
+
+    submission.choice_answers = pack_choice_answers(selected_choices)
+    submission.save(update_fields=['choice_answers'])
+    UserAnswer.objects.bulk_create(code_answers)
+
+QUIZ_PAPER_API_VERSION = 1
+
+def _accepts_gzip(request):
+    return 'gzip' in request.headers.get('Accept-Encoding', '')
+
+def _quiz_paper_etag(quiz_id, updated_at, gzipped):
+    """
+    Strong ETag of one representation of a quiz paper. It changes whenever the quiz,
+    one of its questions or choices, or the payload format changes, and differs
+    between the gzip and identity encodings.
+    """
+    encoding = '-gzip' if gzipped else ''
+    return f'"v{QUIZ_PAPER_API_VERSION}-{quiz_id.hex}-{int(updated_at.timestamp() * 1_000_000)}{encoding}"'
+
+def _quiz_paper_request_etag(request, quiz_id):
+    updated_at = Quiz.objects.filter(pk=quiz_id).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    return _quiz_paper_etag(quiz_id, updated_at, _accepts_gzip(request))
+
+def _build_quiz_paper(quiz):
+    """
+    Returns the gzip-compressed JSON paper of a quiz: its questions and choices,
+    without the `is_correct` flags.
+    """
+    questions = quiz.questions.all().prefetch_related(
+        Prefetch('choices', queryset=Choice.objects.only('id', 'question_id', 'choice_text'))
+    )
+    payload = {
+        'version': QUIZ_PAPER_API_VERSION,
+        'id': quiz.id,
+        'title': quiz.title,
+        'description': quiz.description,
+        'duration_seconds': int(quiz.duration.total_seconds()),
+        'updated_at': quiz.updated_at,
+        'questions': [
+            {
+                'id': q.id,
+                'text': q.question_text,
+                'type': q.question_type,
+                'points': q.points,
+                'order': q.order,
+                'choices': [{'id': c.id, 'text': c.choice_text} for c in q.choices.all()],
+            }
+            for q in questions
+        ],
+    }
+    body = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+    return gzip.compress(body)
+
+@login_required
+@condition(etag_func=_quiz_paper_request_etag)
+def quiz_paper_api(request, quiz_id):
+    """
+    Versioned JSON exam paper for client-side rendering. Clients revalidate with
+    If-None-Match and get a 304 while the quiz is unchanged. The compressed body is
+    built once per quiz version and served from the cache afterwards.
+    """
+    quiz = get_object_or_404(Quiz, pk=quiz_id)
+    cache_key = f'quiz-paper:{_quiz_paper_etag(quiz.id, quiz.updated_at, gzipped=True)}'
+    body = cache.get(cache_key)
+    if body is None:
+        body = _build_quiz_paper(quiz)
+        cache.set(cache_key, body, timeout=None)
+
+    gzipped = _accepts_gzip(request)
+    response = HttpResponse(body if gzipped else gzip.decompress(body), content_type='application/json')
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    # Set here, from the version actually served, rather than by @condition.
+    response['ETag'] = _quiz_paper_etag(quiz.id, quiz.updated_at, gzipped)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+PROFILES_PER_VIEW = 20
+
+@staff_member_required
+def profile_list(request):
+    """
+    Lists the most recent request profiles of each view, newest first.
+    """
+    views_profiles = []
+    root = profiles_root()
+    if root.is_dir():
+        for directory in sorted(path for path in root.iterdir() if path.is_dir()):
+            metadata_files = sorted(directory.glob('*.json'), reverse=True)[:PROFILES_PER_VIEW]
+            profiles = []
+            for metadata_file in metadata_files:
+                with open(metadata_file) as f:
+                    metadata = json.load(f)
+                metadata.pop('sql', None)
+                profiles.append(metadata)
+            views_profiles.append({'directory': directory.name, 'profiles': profiles})
+    return render(request, 'admin/quiz/profile_list.html', {
+        **admin.site.each_context(request),
+        'title': 'Request profiles',
+        'views_profiles': views_profiles,
+    })
+
+@staff_member_required
+def profile_file(request, view_directory, filename):
+    """
+    Downloads one profile file (collapsed stacks or JSON metadata).
+    """
+    root = profiles_root()
+    path = (root / view_directory / filename).resolve()
+    if path.parent.parent != root.resolve() or path.suffix not in ('.folded', '.json') or not path.is_file():
+        raise Http404("Profile not found.")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name)
+
+def _redirect_to_pending(quiz_id, submit_token):
+    url = reverse('quiz:submission_pending', kwargs={'quiz_id': quiz_id})
+    if submit_token is not None:
+        url = f'{url}?token={submit_token.hex}'
+    return redirect(url)
+
+@login_required
+def submission_pending(request, quiz_id):
+    """
+    Shown while a spooled submission waits to be persisted; refreshes itself and
+    moves on to the result page once the submission has been graded, or reports
+    that it could not be saved.
+
+    The submission is identified by its submit token, through the cached outcome
+    or the attempt holding the token, so the page works on any host. Forms without
+    a token fall back to this host's spool and the latest finished attempt.
+    """
+    quiz = get_object_or_404(Quiz, pk=quiz_id)
+    submit_token = _parse_submit_token(request.GET.get('token'))
+    if submit_token is None:
+        if admission.has_pending(request.user.pk, quiz_id):
+            return render(request, 'quiz/submission_pending.html', {'quiz': quiz})
+        submission = (
+            QuizSubmission.objects.filter(user=request.user, quiz_id=quiz_id)
+            .exclude(status=QuizSubmission.SubmissionStatus.IN_PROGRESS)
+            .order_by('-start_time')
+            .first()
+        )
+        if submission is None:
+            return redirect('quiz:quiz_detail', quiz_id=quiz_id)
         return redirect('quiz:submission_result', submission_id=submission.id)
 
-    # The time_left_seconds context variable is needed for the timer in your template
-    time_left_seconds = quiz.duration.total_seconds()
-    return render(request, 'quiz/take_quiz.html', {'quiz': quiz, 'questions': questions, 'time_left_seconds': time_left_seconds})
+    outcome = cache.get(_submit_token_cache_key(request.user.pk, quiz_id, submit_token))
+    if outcome == SUBMIT_TOKEN_FAILED:
+        return render(request, 'quiz/submission_pending.html', {'quiz': quiz, 'failed': True})
+    if outcome not in (None, SUBMIT_TOKEN_PENDING):
+        return redirect('quiz:submission_result', submission_id=outcome)
+    submission = (
+        QuizSubmission.objects.filter(user=request.user, quiz_id=quiz_id, submit_token=submit_token)
+        .exclude(status=QuizSubmission.SubmissionStatus.IN_PROGRESS)
+        .first()
+    )
+    if submission is not None:
+        return redirect('quiz:submission_result', submission_id=submission.id)
+    return render(request, 'quiz/submission_pending.html', {'quiz': quiz})
+
+@staff_member_required
+def submission_metrics(request):
+    """
+    Admission-control metrics of the serving worker process, plus the spool depth
+    shared by all workers on this host.
+    """
+    return JsonResponse(admission.metrics())
 
 @login_required
 def submission_result(request, submission_id):
@@ -71,32 +426,61 @@ def submission_result(request, submission_id):
     return render(request, 'quiz/submission_result.html', {'submission': submission})
 
 @login_required
+@read_from_replica
 def submission_history(request):
-    submissions = QuizSubmission.objects.filter(user=request.user).order_by('-start_time')
+    # Old submissions live in the archive table; both lists come back newest first
+    # and are merged into one history.
+    submissions = QuizSubmission.objects.filter(user=request.user).select_related('quiz').order_by('-start_time')
+    archived_submissions = (
+        ArchivedSubmission.objects.filter(user=request.user)
+        .select_related('quiz')
+        .defer('answers_payload')
+        .order_by('-start_time')
+    )
+    submissions = list(heapq.merge(submissions, archived_submissions, key=attrgetter('start_time'), reverse=True))
     return render(request, 'quiz/submission_history.html', {'submissions': submissions})
 
 
 @login_required
+@read_from_replica
 def submission_detail(request, submission_id):
-    submission = get_object_or_404(
-        QuizSubmission.objects.select_related('quiz'), 
-        pk=submission_id, 
-        user=request.user
-    )
+    context = submission_detail_context(request.user, submission_id)
+    return render(request, 'quiz/submission_detail.html', context)
+
+def submission_detail_context(user, submission_id):
+    """
+    Builds the template context of the submission detail page for one of the user's
+    submissions, live or archived. Raises Http404 when there is no such submission.
+    """
+    submission = QuizSubmission.objects.select_related('quiz').filter(pk=submission_id, user=user).first()
+    if submission is not None:
+        user_answers = submission.answers.all().prefetch_related('selected_choices')
+        selected_choice_ids_map = {
+            ua.question_id: {choice.id for choice in ua.selected_choices.all()} for ua in user_answers
+        }
+    else:
+        # Fall back to the archive for submissions moved out by archive_submissions.
+        submission = get_object_or_404(
+            ArchivedSubmission.objects.select_related('quiz'),
+            pk=submission_id,
+            user=user
+        )
+        user_answers, selected_choice_ids_map = submission.unpack_answers()
     quiz = submission.quiz
     
     total_points = quiz.questions.aggregate(total=Sum('points'))['total'] or 0
 
     questions = quiz.questions.all().prefetch_related('choices')
-    user_answers = submission.answers.all().prefetch_related('selected_choices')
+    if submission.choice_answers is not None:
+        # MCQ/MSQ answers stored in packed form have no UserAnswer rows.
+        choice_ids = {q.id: [c.id for c in q.choices.all()] for q in questions}
+        selected_choice_ids_map.update(unpack_choice_answers(submission.choice_answers, choice_ids))
     user_answers_map = {ua.question_id: ua for ua in user_answers}
 
     questions_data = []
     for q in questions:
         user_answer = user_answers_map.get(q.id)
-        selected_choice_ids = set()
-        if user_answer:
-            selected_choice_ids = set(user_answer.selected_choices.values_list('id', flat=True))
+        selected_choice_ids = selected_choice_ids_map.get(q.id, set())
 
         choices_data = []
         for c in q.choices.all():
@@ -115,9 +499,8 @@ def submission_detail(request, submission_id):
             'choices': choices_data,
         })
 
-    context = {
+    return {
         'submission': submission,
         'questions_with_answers': questions_data,
         'total_points': total_points,
-    }
-    return render(request, 'quiz/submission_detail.html', context)
\ No newline at end of file
+    }
\ No newline at end of file